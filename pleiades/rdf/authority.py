@@ -0,0 +1,120 @@
+# Index of the authority file of Pleiades authors, loaded on first use
+#
+# Run as a script, this precompiles authority.csv to authority.idx, which
+# is then loaded instead of the CSV while it is newer.
+
+import csv
+import marshal
+import os
+import re
+import threading
+import unicodedata
+
+from pleiades.rdf.store import replace_file
+
+AUTHORITY_CSV = os.path.join(os.path.dirname(__file__), 'authority.csv')
+
+
+def normalize(label):
+    """Get the lookup key of a name: case folded, NFC normalized, with
+    runs of whitespace collapsed and none after periods, so that "A.G.
+    Poulter" and "A. G.  Poulter" have the same key."""
+    if isinstance(label, str):
+        label = label.decode('utf-8', 'replace')
+    label = unicodedata.normalize('NFC', label).strip().lower()
+    label = re.sub(r'\.\s+', '.', label)
+    return re.sub(r'\s+', ' ', label)
+
+
+class AuthorityIndex(object):
+    """The (label, username, uri) rows of the authority file, indexed by
+    normalized label, username, and URI (VIAF, usually).
+
+    Lookups by label return (username, uri) pairs like the dict this
+    replaces. The file is read when the index is first used.
+    """
+
+    def __init__(self, path=AUTHORITY_CSV):
+        self.path = path
+        self._index = None
+        self._lock = threading.Lock()
+
+    @property
+    def compiled_path(self):
+        return os.path.splitext(self.path)[0] + '.idx'
+
+    def read(self):
+        """Read the rows of the CSV file."""
+        f = open(self.path, 'rb')
+        try:
+            return [tuple(row) for row in list(csv.reader(f))[1:]]
+        finally:
+            f.close()
+
+    def compile(self):
+        """Write the rows to the precompiled file, loaded in place of the
+        CSV file while it is newer."""
+        replace_file(self.compiled_path, marshal.dumps(self.read()))
+
+    def _rows(self):
+        compiled = self.compiled_path
+        if (os.path.exists(compiled) and
+                os.path.getmtime(compiled) >= os.path.getmtime(self.path)):
+            f = open(compiled, 'rb')
+            try:
+                return marshal.load(f)
+            finally:
+                f.close()
+        return self.read()
+
+    def _load(self):
+        labels, usernames, uris = {}, {}, {}
+        for label, username, uri in self._rows():
+            labels[normalize(label)] = (label, username, uri)
+            if username:
+                usernames[username] = (label, username, uri)
+            if uri:
+                uris[uri] = (label, username, uri)
+        return labels, usernames, uris
+
+    @property
+    def index(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self._load()
+        return self._index
+
+    def reset(self):
+        self._index = None
+
+    def __len__(self):
+        return len(self.index[0])
+
+    def __contains__(self, label):
+        return normalize(label) in self.index[0]
+
+    def __getitem__(self, label):
+        label, username, uri = self.index[0][normalize(label)]
+        return username, uri
+
+    def get(self, label, default=None):
+        if label in self:
+            return self[label]
+        return default
+
+    def by_username(self, username):
+        """Get the (label, username, uri) row of a username, or None."""
+        return self.index[1].get(username)
+
+    def by_uri(self, uri):
+        """Get the (label, username, uri) row of a URI, or None."""
+        return self.index[2].get(uri)
+
+
+authority = AuthorityIndex()
+
+
+if __name__ == '__main__':
+    authority.compile()
+    print "Compiled %d authors to %s" % (len(authority), authority.compiled_path)
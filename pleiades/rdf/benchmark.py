@@ -0,0 +1,606 @@
+# -*- coding: utf-8 -*-
+# Benchmarks of the graphers using synthetic places, without a Plone site
+#
+# Run as "python -m pleiades.rdf.benchmark --help" in an environment where
+# the package's dependencies can be imported.
+
+import gc
+import json
+import sys
+import time
+from contextlib import contextmanager
+from optparse import OptionParser
+
+from rdflib import Namespace, URIRef as URIRef_rdflib
+from shapely.geometry import Point
+
+from pleiades.rdf import common
+from pleiades.rdf.common import CONNECTION_RELATIONSHIP, PlaceGrapher
+from pleiades.rdf.common import place_graph, URIRef
+from pleiades.rdf.memory import rss
+
+PERIODS = ['archaic', 'classical', 'hellenistic-republican', 'roman',
+           'late-antique']
+
+PLACE_TYPES = ['settlement', 'fort', 'temple', 'river', 'mountain']
+
+MEMBERS = ['sgillies', 'thomase', 'jbecker', 'rtalbert']
+
+
+class Request(object):
+    environ = {'VH_ROOT': '/plone'}
+
+
+class Member(object):
+
+    def __init__(self, username):
+        self.username = username
+
+    def getId(self):
+        return self.username
+
+    def getProperty(self, name):
+        return self.username.capitalize()
+
+
+class Membership(object):
+
+    def getMemberById(self, username):
+        if username in MEMBERS:
+            return Member(username)
+        return None
+
+
+class Workflow(object):
+
+    def getInfoFor(self, ob, name):
+        return ob.review_state
+
+
+class Brain(object):
+
+    def __init__(self, ob):
+        self.ob = ob
+        self.portal_type = ob.portal_type
+        self.getId = ob.id
+        self.UID = ob.UID()
+        self.Title = ob.Title()
+        self.Description = ob.Description()
+        self.ModificationDate = ob.ModificationDate()
+        self.Subject = ob.Subject()
+        self.review_state = ob.review_state
+        self.modified = ob.modified()
+
+    def getPath(self):
+        return "/".join(self.ob.getPhysicalPath())
+
+    def getURL(self):
+        return self.ob.absolute_url()
+
+    def getObject(self):
+        return self.ob
+
+
+class Catalog(object):
+    """Supports the queries made by the graphers: by path (one or more
+    paths, with depth 1), portal_type, review_state, getId, and UID."""
+
+    def __init__(self):
+        self.children = {}
+        self.objects = {}
+
+    def index(self, ob):
+        self.objects[ob.UID()] = ob
+        parent = "/".join(ob.getPhysicalPath()[:-1])
+        self.children.setdefault(parent, []).append(ob)
+
+    def __call__(self, **query):
+        path = query.get('path')
+        if path:
+            paths = path['query']
+            if isinstance(paths, basestring):
+                paths = [paths]
+            obs = [ob for p in paths for ob in self.children.get(p, [])]
+        else:
+            obs = self.objects.values()
+        for name in ('portal_type', 'review_state', 'getId', 'UID'):
+            value = query.get(name)
+            if value is None:
+                continue
+            if isinstance(value, basestring):
+                value = [value]
+            obs = [ob for ob in obs if self.value(ob, name) in value]
+        return [Brain(ob) for ob in obs]
+
+    searchResults = __call__
+
+    def value(self, ob, name):
+        value = getattr(ob, name)
+        if callable(value):
+            value = value()
+        return value
+
+    def uniqueValuesFor(self, name):
+        return MEMBERS
+
+
+class Reference(object):
+
+    relationship = CONNECTION_RELATIONSHIP
+
+    def __init__(self, source, target):
+        self.sourceUID = source.UID()
+        self.targetUID = target.UID()
+
+
+class ReferenceCatalog(object):
+    """Supports queries of connections by sourceUID or targetUID."""
+
+    def __init__(self):
+        self.references = []
+
+    def searchResults(self, **query):
+        refs = self.references
+        for name in ('sourceUID', 'targetUID'):
+            if name in query:
+                refs = [r for r in refs if getattr(r, name) in query[name]]
+        return refs
+
+
+class Site(object):
+
+    REQUEST = Request()
+
+    def __init__(self):
+        self.portal_catalog = Catalog()
+        self.reference_catalog = ReferenceCatalog()
+        self.portal_membership = Membership()
+        self.portal_workflow = Workflow()
+        self.vocabularies = {}
+
+    @property
+    def portal_url(self):
+        return self
+
+    def getPortalObject(self):
+        return self
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def absolute_url(self):
+        return "https://pleiades.stoa.org/plone"
+
+    def getPhysicalPath(self):
+        return ('', 'plone')
+
+
+class Content(object):
+
+    review_state = 'published'
+
+    def __init__(self, site, parent, portal_type, id, **kw):
+        self.site = site
+        self.parent = parent
+        self.portal_type = portal_type
+        self.id = id
+        self.__dict__.update(kw)
+        self.REQUEST = site.REQUEST
+        self.portal_catalog = site.portal_catalog
+        self.reference_catalog = site.reference_catalog
+        self.portal_membership = site.portal_membership
+        self.portal_workflow = site.portal_workflow
+        self.portal_url = site
+
+    def getId(self):
+        return self.id
+
+    def UID(self):
+        return "/".join(self.getPhysicalPath())
+
+    def getPhysicalPath(self):
+        return self.parent.getPhysicalPath() + (self.id,)
+
+    def absolute_url(self):
+        return self.parent.absolute_url() + "/" + self.id
+
+    def Title(self):
+        return "%s %s" % (self.portal_type, self.id)
+
+    def Description(self):
+        return "A synthetic %s for benchmarking" % self.portal_type
+
+    def ModificationDate(self):
+        return "2013-06-10 12:00:00"
+
+    def modified(self):
+        return 1370865600.0
+
+    def Subject(self):
+        return ('benchmark',)
+
+    def Creators(self):
+        return (MEMBERS[0],)
+
+    def Contributors(self):
+        return ("%s, A. Bernand" % MEMBERS[1], "S. Gillies")
+
+    def getInitialProvenance(self):
+        return "Barrington Atlas: BAtlas 22 B3"
+
+    def getReferenceCitations(self):
+        return self.citations
+
+    def getAttestations(self):
+        return self.attestations
+
+    def getNameAttested(self):
+        return u"Αθῆναι"
+
+    def getNameTransliterated(self):
+        return "Athenai, Athens"
+
+    def getNameLanguage(self):
+        return "grc"
+
+    def getLocation(self):
+        return getattr(self, 'location', '')
+
+    def getPlaceType(self):
+        return PLACE_TYPES[:2]
+
+    def getModernLocation(self):
+        return ""
+
+    def getConnectedPlaces(self):
+        return self.connections
+
+
+class Places(object):
+
+    def __init__(self, site):
+        self.site = site
+
+    def getPhysicalPath(self):
+        return self.site.getPhysicalPath() + ('places',)
+
+    def absolute_url(self):
+        return self.site.absolute_url() + "/places"
+
+
+class TimeSpan(object):
+
+    def __init__(self, context):
+        self.timeSpan = {'start': -550, 'end': 640}
+
+
+def make_places(n, names=2, locations=2, attestations=2, citations=3,
+                connections=2, rough=0.1):
+    """Make a site of n synthetic places and return it with the list of
+    places. A fraction of the places, given by rough, have only BAtlas
+    grid locations."""
+    site = Site()
+    catalog = site.portal_catalog
+    folder = Places(site)
+    attested = [{'timePeriod': PERIODS[i % len(PERIODS)]}
+                for i in range(attestations)]
+    cited = [{'access_uri': "http://example.org/ref/%d" % i,
+              'type': i % 2 and 'seeFurther' or 'seeAlso',
+              'short_title': "Ref %d" % i, 'citation_detail': "p. %d" % i}
+             for i in range(citations)]
+    places = []
+    for i in range(n):
+        precision = i < n * rough and 'rough' or 'precise'
+        place = Content(
+            site, folder, 'Place', str(100000 + i), precision=precision,
+            attestations=attested, citations=cited, connections=[])
+        catalog.index(place)
+        for j in range(names):
+            catalog.index(Content(
+                site, place, 'Name', "name-%d" % j,
+                attestations=attested, citations=cited))
+        for j in range(locations):
+            kw = {}
+            if precision == 'rough':
+                kw['location'] = "http://atlantides.org/capgrids/%d/B%d" % (
+                    22 + i % 80, 1 + j % 5)
+            else:
+                kw['geometry'] = Point(20.0 + i % 20 + j * 0.01, 38.0)
+            catalog.index(Content(
+                site, place, 'Location', "location-%d" % j,
+                attestations=attested, citations=cited, **kw))
+        places.append(place)
+    for i, place in enumerate(places):
+        place.connections = [
+            places[(i + k + 1) % n] for k in range(min(connections, n - 1))]
+        site.reference_catalog.references.extend(
+            Reference(place, other) for other in place.connections)
+    return site, places
+
+
+@contextmanager
+def fixtures():
+    """Replace the parts of common that need a Plone site (registry
+    vocabularies, geographer, attestation and JSON adapters) with
+    synthetic ones, and empty the process-wide caches."""
+    saved = dict((name, getattr(common, name)) for name in (
+        'get_vocabulary', 'location_precision', 'TimeSpanWrapper', 'wrap',
+        'vocab_index'))
+
+    def get_vocabulary(name):
+        ids = name == 'time_periods' and PERIODS or PLACE_TYPES
+        return [{'id': t, 'title': t.capitalize(), 'description': '',
+                 'same_as': None} for t in ids]
+
+    class Feature(object):
+        def __init__(self, ob, *args):
+            self.geometry = getattr(ob, 'geometry', None)
+
+    common.get_vocabulary = get_vocabulary
+    common.location_precision = lambda ob: ob.precision
+    common.TimeSpanWrapper = TimeSpan
+    common.wrap = Feature
+    common.principal_cache.invalidate()
+    common.vocab_index = common.VocabularyIndex()
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(common, name, value)
+
+
+def measure(stage, func, places, repeat):
+    """Time func over all places, after one warm-up pass, and return
+    a dict of results. The growth of the resident set size over the
+    stage is given in kB, or None where it can't be read; the peak of
+    the process can't be attributed to a stage, as it never falls."""
+    gc.collect()
+    before = rss()
+    for place in places:
+        func(place)
+    triples = 0
+    start = time.time()
+    for i in range(repeat):
+        for place in places:
+            triples += func(place)
+    elapsed = max(time.time() - start, 1e-9)
+    count = len(places) * repeat
+    after = rss()
+    growth = None
+    if before is not None and after is not None:
+        growth = (after - before) / 1024
+    return {
+        'stage': stage,
+        'places': count,
+        'seconds': elapsed,
+        'places_per_sec': count / elapsed,
+        'triples_per_sec': triples / elapsed,
+        'rss_growth_kb': growth}
+
+
+def run(n=200, repeat=3, vocabs=False, **kw):
+    """Run the benchmark stages and return a list of result dicts."""
+    results = []
+    with fixtures():
+        site, places = make_places(n, **kw)
+        grapher = PlaceGrapher(site, site.REQUEST)
+        subs = dict(
+            (p.UID(), site.portal_catalog.children[p.UID()]) for p in places)
+
+        def place(p):
+            return len(grapher.place(p, vocabs=vocabs))
+
+        def each_child(method):
+            def func(p):
+                g = place_graph()
+                for ob in subs[p.UID()]:
+                    subj = URIRef(ob.absolute_url())
+                    if method == 'dcterms':
+                        grapher.dcterms(ob, g)
+                    elif method == 'temporal':
+                        grapher.temporal(ob, g, subj, vocabs=vocabs)
+                    else:
+                        grapher.references(ob, g, subj)
+                return len(g)
+            return func
+
+        graphs = {}
+
+        def serialize(p):
+            g = graphs.get(p.UID())
+            if g is None:
+                g = graphs[p.UID()] = grapher.place(p, vocabs=vocabs)
+            g.serialize(format='nt')
+            return len(g)
+
+        results.append(measure('place', place, places, repeat))
+        for stage in ('dcterms', 'temporal', 'references'):
+            results.append(measure(stage, each_child(stage), places, repeat))
+        results.append(measure('serialize', serialize, places, repeat))
+    return results
+
+
+def legacy_uriref(value):
+    """The URIRef() of pleiades.rdf 0.13, for comparison"""
+    clean = value
+    for char in common._uri_char_replacements:
+        if char in value:
+            clean = clean.replace(char, common._uri_char_replacements[char])
+    return URIRef_rdflib(clean)
+
+
+def sample_uris(n=200):
+    """URIs like those made for a place graph, with the repetition of
+    namespace terms, vocabulary terms, and authors found in real ones."""
+    uris = []
+    for i in range(n):
+        place = "https://pleiades.stoa.org/places/%d" % (100000 + i)
+        uris.extend([
+            place, place + "#this", place.replace('https:', 'http:'),
+            place + "/name-1", place + "/location-1",
+            "http://atlantides.org/capgrids/%d#B%d" % (22 + i % 80, i % 5),
+            "https://pleiades.stoa.org/vocabularies/%s" % PERIODS[i % 5],
+            "https://pleiades.stoa.org/author/%s" % MEMBERS[i % 4],
+            "https://pleiades.stoa.org/places",
+            "http://www.worldcat.org/oclc/%d" % (i % 30),
+            "http://example.org/search?q=%d&p=[1]" % i])
+    return uris
+
+
+def bench_uriref(repeat=20, out=sys.stdout):
+    """Compare the speed of URIRef() with that of the 0.13 version"""
+    uris = sample_uris()
+    results = []
+    for label, func in (
+            ('legacy', legacy_uriref), ('current', common.URIRef)):
+        common._uriref_cache.clear()
+        start = time.time()
+        for i in range(repeat):
+            for uri in uris:
+                func(uri)
+        elapsed = max(time.time() - start, 1e-9)
+        results.append((label, len(uris) * repeat / elapsed))
+    out.write("%-12s %14s\n" % ("URIRef", "calls/sec"))
+    for label, rate in results:
+        out.write("%-12s %14.1f\n" % (label, rate))
+    out.write("speedup: %.2fx\n" % (results[1][1] / results[0][1]))
+    return results
+
+
+def term_lookups(n=20, **kw):
+    """Get the (namespace, term) pairs looked up in making the graphs of
+    n synthetic places."""
+    lookups = []
+    term = common.TermNamespace.term
+
+    def counting_term(self, name):
+        lookups.append((self, name))
+        return term(self, name)
+
+    with fixtures():
+        site, places = make_places(n, **kw)
+        grapher = PlaceGrapher(site, site.REQUEST)
+        common.TermNamespace.term = counting_term
+        try:
+            for p in places:
+                grapher.place(p, vocabs=False)
+        finally:
+            common.TermNamespace.term = term
+    return lookups, len(places)
+
+
+def bench_terms(repeat=20, out=sys.stdout, **kw):
+    """Compare the namespace term lookups of place graphs with shared
+    terms to those with terms made at every lookup, as with a plain
+    rdflib Namespace, in time and memory allocated per place."""
+    lookups, n = term_lookups(**kw)
+    plain = dict((ns, Namespace(unicode(ns))) for ns, name in lookups)
+    results = []
+    for label, pairs in (
+            ('plain', [(plain[ns], name) for ns, name in lookups]),
+            ('shared', lookups)):
+        start = time.time()
+        for i in range(repeat):
+            for ns, name in pairs:
+                ns[name]
+        elapsed = max(time.time() - start, 1e-9)
+        results.append((label, elapsed / (n * repeat) * 1e6))
+    allocated = sum(
+        sys.getsizeof(plain[ns][name]) for ns, name in lookups) / n
+    out.write("lookups per place: %d\n" % (len(lookups) / n))
+    out.write("%-12s %14s\n" % ("terms", "usec/place"))
+    for label, usec in results:
+        out.write("%-12s %14.1f\n" % (label, usec))
+    out.write("saved per place: %.1f usec, %d bytes allocated\n" % (
+        results[0][1] - results[1][1], allocated))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Compare results with a baseline, returning a list of the stages
+    whose throughput fell by more than the tolerated fraction."""
+    base = dict((r['stage'], r) for r in baseline)
+    regressions = []
+    for r in results:
+        b = base.get(r['stage'])
+        if not b:
+            r['ratio'] = None
+            continue
+        r['ratio'] = r['places_per_sec'] / b['places_per_sec']
+        if r['ratio'] < 1.0 - tolerance:
+            regressions.append(r['stage'])
+    return regressions
+
+
+def report(results, out=sys.stdout):
+    out.write("%-12s %10s %12s %14s %10s %8s\n" % (
+        "stage", "places", "places/sec", "triples/sec", "RSS +kB", "ratio"))
+    for r in results:
+        ratio = r.get('ratio')
+        growth = r.get('rss_growth_kb')
+        out.write("%-12s %10d %12.1f %14.1f %10s %8s\n" % (
+            r['stage'], r['places'], r['places_per_sec'],
+            r['triples_per_sec'], growth is None and "-" or growth,
+            ratio is None and "-" or "%.2f" % ratio))
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-n", "--places", type='int', default=200,
+                      help="Number of synthetic places")
+    parser.add_option("--names", type='int', default=2,
+                      help="Names per place")
+    parser.add_option("--locations", type='int', default=2,
+                      help="Locations per place")
+    parser.add_option("--attestations", type='int', default=2,
+                      help="Attestations per name and location")
+    parser.add_option("--citations", type='int', default=3,
+                      help="Citations per place, name, and location")
+    parser.add_option("--connections", type='int', default=2,
+                      help="Connections per place")
+    parser.add_option("--repeat", type='int', default=3,
+                      help="Number of timed passes over the places")
+    parser.add_option("--vocabs", action='store_true', default=False,
+                      help="Include vocabulary concepts in place graphs")
+    parser.add_option("--save", default=None,
+                      help="Save the results as a JSON baseline")
+    parser.add_option("--compare", default=None,
+                      help="Compare the results with a JSON baseline")
+    parser.add_option("--tolerance", type='float', default=0.1,
+                      help="Tolerated fractional loss of throughput")
+    parser.add_option("--uriref", action='store_true', default=False,
+                      help="Only compare URIRef() with the 0.13 version")
+    parser.add_option("--terms", action='store_true', default=False,
+                      help="Only compare shared namespace terms with terms made at every lookup")
+    opts, args = parser.parse_args()
+
+    if opts.uriref:
+        bench_uriref(opts.repeat * 10)
+        sys.exit(0)
+
+    if opts.terms:
+        bench_terms(
+            opts.repeat * 10, names=opts.names, locations=opts.locations,
+            attestations=opts.attestations, citations=opts.citations,
+            connections=opts.connections)
+        sys.exit(0)
+
+    results = run(
+        opts.places, repeat=opts.repeat, vocabs=opts.vocabs,
+        names=opts.names, locations=opts.locations,
+        attestations=opts.attestations, citations=opts.citations,
+        connections=opts.connections)
+
+    regressions = []
+    if opts.compare:
+        f = open(opts.compare)
+        regressions = compare(results, json.load(f), opts.tolerance)
+        f.close()
+    report(results)
+    if opts.save:
+        f = open(opts.save, 'w')
+        json.dump(results, f, indent=2)
+        f.close()
+    if regressions:
+        sys.stderr.write("Regressions in: %s\n" % ", ".join(regressions))
+        sys.exit(1)
@@ -1,10 +1,14 @@
 # RDF browser views
 
 import logging
+from email.utils import formatdate, mktime_tz, parsedate_tz
+from hashlib import md5
 
+from Products.CMFCore.utils import getToolByName
 from zope.interface import implements, Interface
 from zope.publisher.browser import BrowserView
 
+from pleiades.rdf.cache import graph_cache
 from pleiades.rdf.common import PlaceGrapher, VocabGrapher
 
 EXTS = {'turtle': '.ttl', 'pretty-xml': '.rdf'}
@@ -23,28 +27,90 @@ class PlaceGraph(BrowserView):
     def graph(self):
         return PlaceGrapher(self.context, self.request).place(self.context)
 
+    _version = None
+
+    def version(self):
+        """Get a value that changes when the place or any of its names
+        or locations are modified, added, removed, or change state.
+        Its first item is the latest modification date."""
+        if self._version is not None:
+            return self._version
+        catalog = getToolByName(self.context, 'portal_catalog')
+        path = "/".join(self.context.getPhysicalPath())
+        brains = catalog(
+            path={'query': path, 'depth': 1},
+            portal_type=['Name', 'Location'])
+        dates = [self.context.modified()] + [b.modified for b in brains]
+        self._version = (
+            max(dates),
+            tuple(sorted((b.getId, b.review_state) for b in brains)))
+        return self._version
+
+    def not_modified(self, format):
+        """Set the ETag and Last-Modified headers of the response and, if
+        the client's copy of the graph is current, its 304 status.
+
+        Only the catalog is consulted, so that conditional requests for
+        unchanged places don't cost a graph build.
+        """
+        version = self.version()
+        etag = '"%s"' % md5(repr(
+            (self.context.absolute_url(), format, version))).hexdigest()
+        modified = int(version[0].timeTime())
+        response = self.request.response
+        response.setHeader('ETag', etag)
+        response.setHeader('Last-Modified', formatdate(modified, usegmt=True))
+
+        if_none_match = self.request.get_header('If-None-Match')
+        if_modified_since = self.request.get_header('If-Modified-Since')
+        if if_none_match:
+            tags = [t.strip() for t in if_none_match.split(',')]
+            current = etag in tags or '*' in tags
+        elif if_modified_since:
+            since = parsedate_tz(if_modified_since)
+            current = since is not None and modified <= mktime_tz(since)
+        else:
+            current = False
+        if current:
+            response.setStatus(304)
+        return current
+
+    def serialize(self, format):
+        """Get the serialized graph of the place, from the cache if it
+        is still current."""
+        key = (self.context.UID(), self.context.absolute_url(), format)
+        version = self.version()
+        data = graph_cache.get(key, version)
+        if data is None:
+            data = self.graph().serialize(format=format)
+            graph_cache.set(key, version, data)
+        return data
+
 
 class PlaceGraphTurtle(PlaceGraph):
 
     def __call__(self):
+        if self.not_modified('turtle'):
+            return ''
         self.request.response.setStatus(200)
         self.request.response.setHeader(
             'Content-Type', "text/turtle; charset=utf-8")
         self.request.response.setHeader(
             'Content-Disposition', "filename=%s.ttl" % self.context.getId())
-        g = self.graph()
-        return g.serialize(format='turtle')
+        return self.serialize('turtle')
 
 
 class PlaceGraphRDF(PlaceGraph):
 
     def __call__(self):
+        if self.not_modified('pretty-xml'):
+            return ''
         self.request.response.setStatus(200)
         self.request.response.setHeader(
             'Content-Type', "application/rdf+xml")
         self.request.response.setHeader(
             'Content-Disposition', "filename=%s.rdf" % self.context.getId())
-        return self.graph().serialize(format='pretty-xml')
+        return self.serialize('pretty-xml')
 
 
 class VocabGraph(BrowserView):
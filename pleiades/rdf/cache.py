@@ -0,0 +1,85 @@
+# Cache of serialized place graphs for the browser views
+
+import threading
+import time
+from collections import OrderedDict
+
+from Acquisition import aq_inner, aq_parent
+
+
+class GraphCache(object):
+    """A size bounded, least recently used cache of serialized graphs.
+
+    Keys are tuples that begin with the UID of a place. Each entry
+    carries a version made from the modification dates of the place and
+    its children, and a lookup with a different version is a miss.
+    Changes that don't touch those dates, such as the unpublishing of a
+    connected place, are picked up when entries expire after maxage
+    seconds.
+    """
+
+    def __init__(self, maxbytes=64 * 1024 * 1024, maxage=3600):
+        self.maxbytes = maxbytes
+        self.maxage = maxage
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if (entry is None or entry[0] != version or
+                    now - entry[2] >= self.maxage):
+                if entry is not None:
+                    self.size -= len(entry[1])
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, version, data):
+        if len(data) > self.maxbytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self._entries[key] = (version, data, time.time())
+            self.size += len(data)
+            while self.size > self.maxbytes:
+                k, entry = self._entries.popitem(last=False)
+                self.size -= len(entry[1])
+
+    def invalidate(self, uid=None):
+        """Drop the entries of a place, or all entries."""
+        with self._lock:
+            if uid is None:
+                self._entries.clear()
+                self.size = 0
+                return
+            for key in self._entries.keys():
+                if key[0] == uid:
+                    self.size -= len(self._entries.pop(key)[1])
+
+    def stats(self):
+        return {
+            'hits': self.hits, 'misses': self.misses,
+            'entries': len(self._entries), 'size': self.size}
+
+
+graph_cache = GraphCache()
+
+
+def invalidate_place(context, event):
+    """Event handler dropping the cached graphs of a modified place or of
+    the place of a modified name or location."""
+    place = context
+    if getattr(context, 'portal_type', None) in ('Name', 'Location'):
+        place = aq_parent(aq_inner(context))
+    uid = getattr(place, 'UID', None)
+    if uid is not None:
+        graph_cache.invalidate(uid())
@@ -0,0 +1,135 @@
+# A queue of changed places, fed by the site and consumed by worker.py
+
+import logging
+import os
+import sqlite3
+import time
+
+import transaction
+from Acquisition import aq_inner, aq_parent
+from Products.CMFCore.utils import getToolByName
+
+from pleiades.rdf.common import connected_uids
+
+log = logging.getLogger('pleiades.rdf')
+
+# Environment variable naming the queue database of a Zope instance.
+QUEUE_ENVIRON = 'PLEIADES_RDF_QUEUE'
+
+
+class ChangeQueue(object):
+    """Ids of changed places in a SQLite database.
+
+    A place is queued once however often it is changed: repeated changes
+    update the time of its last change and count its edits, and the time
+    of its first change is kept for measuring lag. Places are taken
+    once they have been left alone for a while, so that a burst of edits
+    is graphed once, and are removed only when done, unless changed
+    again in the meantime.
+    """
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=timeout)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS changes ("
+            "id TEXT PRIMARY KEY, first REAL NOT NULL, last REAL NOT NULL, "
+            "edits INTEGER NOT NULL)")
+        self.db.commit()
+
+    def put(self, pid, when=None):
+        when = when or time.time()
+        with self.db:
+            cursor = self.db.execute(
+                "UPDATE changes SET last = ?, edits = edits + 1 WHERE id = ?",
+                (when, pid))
+            if cursor.rowcount == 0:
+                self.db.execute(
+                    "INSERT INTO changes (id, first, last, edits) "
+                    "VALUES (?, ?, ?, 1)", (pid, when, when))
+
+    def take(self, limit, settle=0.0):
+        """Get up to limit (id, last change) pairs of the places longest
+        in the queue that haven't changed in the last settle seconds."""
+        return list(self.db.execute(
+            "SELECT id, last FROM changes WHERE last <= ? "
+            "ORDER BY first LIMIT ?", (time.time() - settle, limit)))
+
+    def done(self, entries):
+        """Remove taken places that haven't changed since."""
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM changes WHERE id = ? AND last = ?", entries)
+
+    def retry(self, pids):
+        """Put failed places back, to be taken again after settling."""
+        for pid in pids:
+            self.put(pid)
+
+    def stats(self):
+        """Get the number of queued places and the age in seconds of the
+        oldest change."""
+        depth, first = self.db.execute(
+            "SELECT COUNT(*), MIN(first) FROM changes").fetchone()
+        return {
+            'pending': depth,
+            'lag': first and max(0.0, time.time() - first) or 0.0}
+
+    def close(self):
+        self.db.close()
+
+
+def connected_ids(place):
+    """Get the ids of the places that connect with a place."""
+    uid = place.UID()
+    uids = connected_uids(place, [uid], incoming=True).get(uid)
+    if not uids:
+        return []
+    catalog = getToolByName(place, 'portal_catalog')
+    return [b.getId for b in catalog.searchResults(
+        portal_type='Place', UID=list(uids))]
+
+
+def queue_after_commit(path, pids):
+    """Put the ids of places in the queue at path once the transaction
+    commits."""
+
+    def hook(status):
+        if not status:
+            return
+        try:
+            queue = ChangeQueue(path)
+            try:
+                for pid in pids:
+                    queue.put(pid)
+            finally:
+                queue.close()
+        except sqlite3.Error:
+            log.exception("Failed to queue changed places %s", ", ".join(pids))
+
+    transaction.get().addAfterCommitHook(hook)
+
+
+def queue_place(context, event):
+    """Event handler queueing the id of a modified place, or of the
+    place of a modified or removed name or location, once the
+    transaction commits. Does nothing unless the queue is configured in
+    the environment."""
+    path = os.environ.get(QUEUE_ENVIRON)
+    if not path:
+        return
+    place = context
+    if getattr(context, 'portal_type', None) in ('Name', 'Location'):
+        place = aq_parent(aq_inner(context))
+    queue_after_commit(path, [place.getId()])
+
+
+def queue_removed_place(context, event):
+    """Event handler queueing the id of a place about to be removed, and
+    of the places that connect with it, once the transaction commits.
+    Those places are found now, while the references to the place still
+    exist."""
+    path = os.environ.get(QUEUE_ENVIRON)
+    if not path:
+        return
+    queue_after_commit(path, [context.getId()] + connected_ids(context))
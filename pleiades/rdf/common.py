@@ -1,9 +1,14 @@
 # Common classes and functions
 
-import csv
+import json
 import os
 import re
+import heapq
+import threading
+import time
 import urllib
+from collections import OrderedDict, namedtuple
+from functools import wraps
 from urlparse import urlparse, urljoin
 
 import geojson
@@ -18,67 +23,215 @@ from Acquisition import aq_inner, aq_parent
 from Products.CMFCore.utils import getToolByName
 
 from pleiades.geographer.geo import location_precision
+from pleiades.rdf.authority import authority
+from pleiades.rdf.store import replace_file
 from pleiades.json.browser import wrap
 from pleiades.vocabularies.vocabularies import get_vocabulary
 
 from Products.PleiadesEntity.browser.attestations import TimeSpanWrapper
 
+class TermNamespace(Namespace):
+    """A Namespace that makes each of its terms once and shares it,
+    rather than making a new URIRef at every use. The terms used by the
+    graphers are made when the namespace is defined."""
+
+    def __new__(cls, value, terms=()):
+        ns = Namespace.__new__(cls, value)
+        ns._terms = {}
+        for name in terms:
+            ns.term(name)
+        return ns
+
+    def term(self, name):
+        try:
+            return self._terms[name]
+        except KeyError:
+            value = self._terms[name] = Namespace.term(self, name)
+            return value
+
+
 CITO_URI = "http://purl.org/spar/cito/"
-CITO = Namespace(CITO_URI)
+CITO = TermNamespace(CITO_URI, [
+    'citesAsRelated', 'citesForInformation'])
 
 DCTERMS_URI = "http://purl.org/dc/terms/"
-DCTERMS = Namespace(DCTERMS_URI)
+DCTERMS = TermNamespace(DCTERMS_URI, [
+    'bibliographicCitation', 'contributor', 'coverage', 'creator',
+    'description', 'modified', 'subject', 'title'])
 
 FOAF_URI = "http://xmlns.com/foaf/0.1/"
-FOAF = Namespace(FOAF_URI)
+FOAF = TermNamespace(FOAF_URI, ['Person', 'isPrimaryTopicOf', 'name'])
 
 GEO_URI = "http://www.w3.org/2003/01/geo/wgs84_pos#"
-GEO = Namespace(GEO_URI)
+GEO = TermNamespace(GEO_URI, ['lat', 'long'])
 
 OSGEO_URI = "http://data.ordnancesurvey.co.uk/ontology/geometry/"
-OSGEO = Namespace(OSGEO_URI)
+OSGEO = TermNamespace(OSGEO_URI, [
+    'AbstractGeometry', 'asGeoJSON', 'asWKT', 'extent'])
 
 SKOS_URI = "http://www.w3.org/2004/02/skos/core#"
-SKOS = Namespace(SKOS_URI)
+SKOS = TermNamespace(SKOS_URI, [
+    'Concept', 'ConceptScheme', 'altLabel', 'inScheme', 'prefLabel',
+    'scopeNote'])
 
 RDFS_URI = "http://www.w3.org/2000/01/rdf-schema#"
-RDFS = Namespace(RDFS_URI)
+RDFS = TermNamespace(RDFS_URI, ['comment', 'label', 'seeAlso'])
 
 SPATIAL_URI = "http://geovocab.org/spatial#"
-SPATIAL = Namespace(SPATIAL_URI)
+SPATIAL = TermNamespace(SPATIAL_URI, ['C', 'Feature'])
 
 OSSPATIAL_URI = "http://data.ordnancesurvey.co.uk/ontology/spatialrelations/"
-OSSPATIAL = Namespace(OSSPATIAL_URI)
+OSSPATIAL = TermNamespace(OSSPATIAL_URI, ['partiallyOverlaps', 'within'])
 
 OWL_URI = "http://www.w3.org/2002/07/owl#"
-OWL = Namespace(OWL_URI)
+OWL = TermNamespace(OWL_URI, ['sameAs'])
 
 PLACES = "https://pleiades.stoa.org/places/"
+PLACES_SCHEME = URIRef_rdflib("https://pleiades.stoa.org/places")
 
 PLEIADES_URI = "https://pleiades.stoa.org/places/vocab#"
-PLEIADES = Namespace(PLEIADES_URI)
+PLEIADES = TermNamespace(PLEIADES_URI, [
+    'Location', 'Name', 'Place', 'during', 'hasFeatureType',
+    'hasLocation', 'hasName', 'nameAttested', 'nameRomanized'])
 
 PROVO_URI = "http://www.w3.org/TR/prov-o/#"
-PROV = Namespace(PROVO_URI)
+PROV = TermNamespace(PROVO_URI, ['wasDerivedFrom'])
 
 log = logging.getLogger('pleiades.rdf')
 
 
+class Profiler(object):
+    """Opt-in wall time and call counts of the stages of graph building.
+
+    When disabled, as it is by default, a stage costs only a check of
+    the enabled flag. Stages nest: the time of 'place' includes that of
+    'names', which includes that of 'dcterms', and so on. Besides the
+    totals, the stages of the slowest places are kept.
+    """
+
+    def __init__(self, slowest=50):
+        self.enabled = False
+        self.slowest = slowest
+        self.reset()
+
+    def reset(self):
+        self.totals = {}
+        self.count = 0
+        self._place = None
+        self._heap = []
+
+    def start(self):
+        if self.enabled:
+            return time.time()
+        return None
+
+    def stop(self, stage, started):
+        if started is None:
+            return
+        seconds = time.time() - started
+        for stages in (self.totals, self._place and self._place[1]):
+            if stages is None:
+                continue
+            entry = stages.setdefault(stage, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def begin(self, pid):
+        """Begin recording the stages of a place"""
+        if self.enabled:
+            self._place = (pid, {}, time.time())
+
+    def end(self):
+        if self._place is None:
+            return
+        pid, stages, started = self._place
+        self._place = None
+        self.count += 1
+        item = (time.time() - started, pid, stages)
+        if len(self._heap) < self.slowest:
+            heapq.heappush(self._heap, item)
+        else:
+            heapq.heappushpop(self._heap, item)
+
+    def profile(self):
+        """Get the totals and slowest places as a JSON-serializable dict"""
+        return {
+            'places': self.count,
+            'stages': dict(
+                (stage, {'calls': calls, 'seconds': seconds})
+                for stage, (calls, seconds) in self.totals.items()),
+            'slowest': [
+                {'id': pid, 'seconds': seconds, 'stages': dict(
+                    (stage, {'calls': c, 'seconds': t})
+                    for stage, (c, t) in stages.items())}
+                for seconds, pid, stages in sorted(self._heap, reverse=True)]}
+
+    def summary(self):
+        """Get a table of the stage totals as text"""
+        lines = ["%-22s %10s %12s %14s" % (
+            "stage", "calls", "seconds", "ms per place")]
+        for stage, (calls, seconds) in sorted(
+                self.totals.items(), key=lambda item: -item[1][1]):
+            lines.append("%-22s %10d %12.3f %14.3f" % (
+                stage, calls, seconds, 1000.0 * seconds / max(self.count, 1)))
+        return "\n".join(lines) + "\n"
+
+
+profiler = Profiler()
+
+
+def profiled(stage):
+    """Record calls of the decorated function as a profiler stage"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kw):
+            started = profiler.start()
+            try:
+                return func(*args, **kw)
+            finally:
+                profiler.stop(stage, started)
+        return wrapper
+    return decorator
+
+
 _invalid_uri_chars = '<>" {}|\\^`[]%#\t'
+_invalid_uri_re = re.compile('[%s]' % re.escape(_invalid_uri_chars))
 _uri_char_replacements = {c: urllib.quote_plus(c) for c in _invalid_uri_chars}
 
+# In values containing '%', the escapes of '#' and '"' have always been
+# escaped again. This is kept so that URIs don't change.
+_uri_char_replacements_pct = dict(
+    _uri_char_replacements, **{'#': '%2523', '"': '%2522'})
+
+URIREF_CACHE_SIZE = 100000
+_uriref_cache = {}
+
 
 def URIRef(value):
     """Wrap the rdflib.URIRef() constructor to selectively escape
     characters first.
-    """
-    clean = value
-
-    for char in _uri_char_replacements:
-        if char in value:
-            clean = clean.replace(char, _uri_char_replacements[char])
 
-    return URIRef_rdflib(clean)
+    Escaping is done in a single pass, and the URIRefs of recently seen
+    values are interned in a bounded cache, so that the namespace terms,
+    vocabulary terms, and author URIs repeated in every place graph are
+    made only once.
+    """
+    ref = _uriref_cache.get(value)
+    if ref is None:
+        if _invalid_uri_re.search(value) is None:
+            clean = value
+        else:
+            if '%' in value:
+                replacements = _uri_char_replacements_pct
+            else:
+                replacements = _uri_char_replacements
+            clean = _invalid_uri_re.sub(
+                lambda m: replacements[m.group()], value)
+        ref = URIRef_rdflib(clean)
+        if len(_uriref_cache) >= URIREF_CACHE_SIZE:
+            _uriref_cache.clear()
+        _uriref_cache[value] = ref
+    return ref
 
 
 def geoContext(place):
@@ -124,16 +277,28 @@ def skos_graph():
 
 
 def user_info(context, username):
+    """Get the id, full name, and author page URL of a site member."""
+    return principal_cache.user_info(context, username)
+
+
+# Names used for members in older content.
+USERNAME_ALIASES = {'T. Elliott': 'thomase', 'S. Gillies': 'sgillies'}
+
+
+def _member_info(member_id, fullname):
+    return {
+        "id": member_id,
+        "fullname": fullname,
+        'url': "https://pleiades.stoa.org/author/" + member_id}
+
+
+@profiled('user_info')
+def _user_info(context, username):
     mtool = getToolByName(context, 'portal_membership')
-    if username == 'T. Elliott': un = 'thomase'
-    elif username == 'S. Gillies': un = 'sgillies'
-    else: un = username
+    un = USERNAME_ALIASES.get(username, username)
     member = mtool.getMemberById(un)
     if member:
-        return {
-            "id": member.getId(),
-            "fullname": member.getProperty('fullname'),
-            'url': "https://pleiades.stoa.org/author/" + member.getId()}
+        return _member_info(member.getId(), member.getProperty('fullname'))
     else:
         return {"id": None, "fullname": un, 'url': None}
 
@@ -149,12 +314,396 @@ def principals(context):
         creators.remove("sgillies")
     return creators, contributors
 
-authority = {}
-f = open(os.path.join(os.path.dirname(__file__), 'authority.csv'))
-reader = csv.reader(f)
-for label, username, uri in list(reader)[1:]:
-    authority[label] = (username, uri)
-f.close()
+
+def _principal(context, principal):
+    """Resolve a creator or contributor to an author URL (None if
+    there isn't one) and a full name, falling back to the authority
+    table for authors who aren't site members."""
+    return _author(principal, _user_info(context, principal))
+
+
+def _author(principal, p):
+    url = p.get('url')
+    if not url and principal in authority:
+        username, url = authority.get(principal)
+        if username and not url:
+            url = "https://pleiades.stoa.org/author/" + username
+    return {"id": p.get('id'), "fullname": p.get('fullname'), 'url': url}
+
+
+class PrincipalCache(object):
+    """A bounded, least recently used cache of resolved principals.
+
+    A single instance is shared by all graphers in a process so that
+    each author is looked up in the membership tool once rather than
+    for every content item. Entries expire after maxage seconds, or
+    sooner when invalidated, so that long running Zope processes see
+    changes to member properties. Cached values must not be modified.
+
+    In bulk dumps, principals may be resolved from a MemberMap of all
+    members instead (see use_members).
+    """
+
+    def __init__(self, maxsize=1024, maxage=3600):
+        self.maxsize = maxsize
+        self.maxage = maxage
+        self.members = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key, resolve, context, username):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and now - entry[0] < self.maxage:
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = resolve(context, username)
+        with self._lock:
+            self._entries[key] = (now, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def user_info(self, context, username):
+        if self.members is not None:
+            return self.members.user_info(context, username)
+        return self._get(('member', username), _user_info, context, username)
+
+    def principal(self, context, principal):
+        if self.members is not None:
+            return self.members.principal(context, principal)
+        return self._get(('principal', principal), _principal, context, principal)
+
+    def use_members(self, members):
+        """Resolve principals from a MemberMap, or from the membership
+        tool again if members is None."""
+        self.members = members
+        self.invalidate()
+
+    def invalidate(self, username=None):
+        """Drop the entries for a username or label, and for any label
+        resolved to that member, or all entries if no username is given."""
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+                return
+            for key, (t, value) in self._entries.items():
+                if key[1] == username or value.get('id') == username:
+                    del self._entries[key]
+
+    def stats(self):
+        return {
+            'hits': self.hits, 'misses': self.misses,
+            'size': len(self._entries)}
+
+
+principal_cache = PrincipalCache()
+
+
+class MemberMap(object):
+    """The ids and full names of all site members, read at once from the
+    user and property plugins of acl_users instead of looking members up
+    one by one. Resolves usernames and principals like the membership
+    tool based functions above.
+    """
+
+    def __init__(self, members=None):
+        self.members = members or {}
+
+    @classmethod
+    @profiled('member map')
+    def load(cls, context):
+        acl_users = getToolByName(context, 'acl_users')
+        members = {}
+        for info in acl_users.searchUsers():
+            member_id = info.get('id')
+            title = info.get('title')
+            if title and title != member_id:
+                members[member_id] = title
+            else:
+                members.setdefault(member_id, '')
+        return cls(members)
+
+    def __len__(self):
+        return len(self.members)
+
+    def user_info(self, context, username):
+        un = USERNAME_ALIASES.get(username, username)
+        if un in self.members:
+            return _member_info(un, self.members[un])
+        return {"id": None, "fullname": un, 'url': None}
+
+    def principal(self, context, principal):
+        return _author(principal, self.user_info(context, principal))
+
+
+def concept_triples(portal_url, vocab_name, term):
+    """Make the SKOS triples representing a registry vocabulary term"""
+    triples = []
+    vurl = urljoin(portal_url, '/vocabularies/', vocab_name)
+    turl = urljoin(vurl, term['id'])
+    term_ref = URIRef(turl)
+    label = term['title']
+    note = term['description']
+    same_as = term['same_as']
+
+    triples.append((term_ref, RDF.type, SKOS['Concept']))
+    triples.append((term_ref, SKOS['prefLabel'], Literal(label, "en")))
+
+    if note:
+        triples.append((term_ref, SKOS['scopeNote'], Literal(note, "en")))
+
+    if same_as:
+        triples.append((term_ref, OWL['sameAs'], URIRef(same_as)))
+
+    triples.append((term_ref, SKOS['inScheme'], URIRef(vurl)))
+
+    orig_url = turl.replace('https://', 'http://')
+    if orig_url and orig_url != turl:
+        triples.append((term_ref, OWL['sameAs'], URIRef(orig_url)))
+
+    return tuple(triples)
+
+
+class VocabularyIndex(object):
+    """Registry vocabularies indexed by term id.
+
+    The terms of the time period and place type vocabularies, the URIs
+    of their terms, and the SKOS triples of their concepts are made once
+    and shared by all graphers in a process. After maxage seconds the
+    registry is read again, and a vocabulary is reindexed only if its
+    terms have changed.
+    """
+
+    def __init__(self, maxage=300):
+        self.maxage = maxage
+        self._vocabs = {}
+        self._refs = {}
+        self._concepts = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, vocab_name):
+        now = time.time()
+        entry = self._vocabs.get(vocab_name)
+        if entry is not None and now - entry['checked'] < self.maxage:
+            return entry
+        terms = get_vocabulary(vocab_name.replace('-', '_'))
+        with self._lock:
+            if entry is not None and entry['terms'] == terms:
+                entry['checked'] = now
+                return entry
+            entry = {
+                'checked': now,
+                'terms': terms,
+                'index': dict([(t['id'], t) for t in terms])}
+            self._vocabs[vocab_name] = entry
+            for key in self._concepts.keys():
+                if key[1] == vocab_name:
+                    del self._concepts[key]
+        return entry
+
+    def vocabulary(self, vocab_name):
+        """Get the list of terms of a vocabulary such as 'time-periods'"""
+        return self._entry(vocab_name)['terms']
+
+    def terms(self, vocab_name):
+        """Get a dict of the terms of a vocabulary, keyed by id"""
+        return self._entry(vocab_name)['index']
+
+    def term_ref(self, portal_url, vocab_name, term_id):
+        """Get the URIRef of a vocabulary term"""
+        key = (portal_url, vocab_name, term_id)
+        ref = self._refs.get(key)
+        if ref is None:
+            vurl = urljoin(portal_url, '/vocabularies/' + vocab_name)
+            ref = self._refs[key] = URIRef(urljoin(vurl, term_id))
+        return ref
+
+    def concept(self, portal_url, vocab_name, term_id):
+        """Get the SKOS triples of a vocabulary term"""
+        key = (portal_url, vocab_name, term_id)
+        triples = self._concepts.get(key)
+        if triples is None:
+            term = self.terms(vocab_name)[term_id]
+            triples = concept_triples(portal_url, vocab_name, term)
+            self._concepts[key] = triples
+        return triples
+
+
+vocab_index = VocabularyIndex()
+
+
+class GridExtentCache(object):
+    """Triples describing the extents of Barrington Atlas grids.
+
+    The set of grids is finite, so the extent of each grid is computed
+    and serialized as GeoJSON and WKT only the first time it is used.
+    The serialized extents can be saved to and loaded from a JSON file
+    so that later processes needn't compute them again.
+    """
+
+    gridbase = "http://atlantides.org/capgrids/"
+
+    def __init__(self):
+        self._literals = {}
+        self._triples = {}
+
+    def _key(self, mapnum, grid):
+        return "%s/%s" % (mapnum, grid or "")
+
+    @profiled('capgrid extents')
+    def extent(self, mapnum, grid):
+        """Get the triples of the extent of a map grid, or of the whole
+        map if grid is None."""
+        key = self._key(mapnum, grid)
+        triples = self._triples.get(key)
+        if triples is None:
+            literals = self._literals.get(key)
+            if literals is None:
+                shape = box(*capgrids.box(mapnum, grid))
+                literals = (geojson.dumps(shape), wkt.dumps(shape))
+                self._literals[key] = literals
+            grid_uri = self.gridbase + mapnum + "#" + (grid or "this")
+            e = URIRef(grid_uri + "-extent")
+            triples = (
+                (e, RDF.type, OSGEO['AbstractGeometry']),
+                (URIRef(grid_uri), OSGEO['extent'], e),
+                (e, OSGEO['asGeoJSON'], Literal(literals[0])),
+                (e, OSGEO['asWKT'], Literal(literals[1])))
+            self._triples[key] = triples
+        return triples
+
+    def load(self, path):
+        """Load serialized extents saved by an earlier process."""
+        f = open(path, 'rb')
+        try:
+            for key, literals in json.load(f).items():
+                self._literals[key] = tuple(literals)
+        finally:
+            f.close()
+
+    def save(self, path):
+        """Save serialized extents, replacing the file atomically."""
+        replace_file(path, json.dumps(self._literals))
+
+
+grid_extents = GridExtentCache()
+
+
+# Relationship of the references of the connections field of places,
+# from which getConnectedPlaces() gets its places.
+CONNECTION_RELATIONSHIP = 'connectsWith'
+
+
+def connected_uids(context, uids, incoming=False):
+    """Get the UIDs of the places that many places connect with, the
+    targets of their connections as getConnectedPlaces() returns them,
+    by UID. If incoming is true, get the UIDs of the places that connect
+    with them instead."""
+    if not uids:
+        return {}
+    if incoming:
+        own, other = 'targetUID', 'sourceUID'
+    else:
+        own, other = 'sourceUID', 'targetUID'
+    rc = getToolByName(context, 'reference_catalog')
+    connected = {}
+    for r in rc.searchResults(
+            relationship=CONNECTION_RELATIONSHIP, **{own: uids}):
+        connected.setdefault(getattr(r, own), []).append(getattr(r, other))
+    return connected
+
+
+@profiled('getObject')
+def get_object(brain):
+    return brain.getObject()
+
+
+def location_geometry(ob):
+    """Get the GeoJSON-like geometry of a Location or None"""
+    f = wrap(ob, 0)
+    if f.geometry and hasattr(f.geometry, '__geo_interface__'):
+        return f.geometry
+    return None
+
+
+LocationGeometry = namedtuple(
+    'LocationGeometry', ['bounds', 'centroid', 'geojson', 'wkt'])
+
+
+class GeometryCache(object):
+    """Geometries of locations, as computed from their shapes once for
+    both the representative point of a place and the location triples:
+    bounds, centroid (x, y), GeoJSON, and WKT.
+
+    If keep is true, geometries are kept, keyed by the path and
+    modification date of their location, and can be saved to and loaded
+    from a JSON file so that later dumps needn't wrap and compute
+    unmodified locations again. At most maxsize are kept, dropping the
+    least recently used.
+    """
+
+    def __init__(self, keep=False, maxsize=100000):
+        self.keep = keep
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def _trim(self):
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _key(self, ob):
+        return '/'.join(ob.getPhysicalPath()), str(ob.modified())
+
+    @profiled('geometry')
+    def geometry(self, ob):
+        """Get the LocationGeometry of a Location, or None if it has no
+        geometry."""
+        if self.keep:
+            path, modified = self._key(ob)
+            entry = self._entries.pop(path, None)
+            if entry is not None and entry[0] == modified:
+                self._entries[path] = entry
+                return entry[1] and LocationGeometry(*entry[1])
+        value = None
+        geometry = location_geometry(ob)
+        if geometry is not None:
+            shape = asShape(geometry)
+            centroid = shape.centroid
+            value = LocationGeometry(
+                tuple(shape.bounds),
+                not centroid.is_empty and (centroid.x, centroid.y) or None,
+                geojson.dumps(shape), wkt.dumps(shape))
+        if self.keep:
+            self._entries[path] = (modified, value)
+            self._trim()
+        return value
+
+    def load(self, path):
+        """Load geometries saved by an earlier process, as more recently
+        used than those already kept."""
+        f = open(path, 'rb')
+        try:
+            entries = json.load(f, object_pairs_hook=OrderedDict)
+        finally:
+            f.close()
+        for key, entry in entries.items():
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+        self._trim()
+
+    def save(self, path):
+        """Save kept geometries, replacing the file atomically."""
+        replace_file(path, json.dumps(self._entries))
+
+
+location_geometries = GeometryCache()
+
 
 class PleiadesGrapher(object):
 
@@ -178,12 +727,16 @@ class PleiadesGrapher(object):
         """We don't want the VH_ROOT ('/plone' or similar) in URLs
         we output.
         """
-        context_url = context.absolute_url()
-        if self.vh_root and self.vh_root in context_url:
-            return urljoin(*context_url.split(self.vh_root))
+        return self.unrooted(context.absolute_url())
+
+    def unrooted(self, url):
+        """Remove the VH_ROOT from a URL"""
+        if self.vh_root and self.vh_root in url:
+            return urljoin(*url.split(self.vh_root))
         else:
-            return context_url
+            return url
 
+    @profiled('dcterms')
     def dcterms(self, context, g):
         """Return a set of tuples covering DC metadata"""
 
@@ -218,59 +771,34 @@ class PleiadesGrapher(object):
         # Authors
         creators, contributors = principals(context)
 
-        for principal in creators:
-            p = user_info(context, principal)
-            url = p.get('url')
-            opnode = None
-            if not url:
-                if principal in self.authority:
-                    username, url = self.authority.get(principal)
-                    if username and not url:
-                        url = "https://pleiades.stoa.org/author/" + username
-            if url:
-                old_url = url.replace('https://', 'http://')
-                pnode = URIRef(url)
-                opnode = URIRef(old_url)
-            else:
-                pnode = BNode()
-                opnode = None
-            g.add((subj, DCTERMS['creator'], pnode))
-            if not url and p.get('fullname'):
-                g.add((pnode, RDF.type, FOAF['Person']))
-                g.add((pnode, FOAF['name'], Literal(p.get('fullname'))))
-                if opnode:
-                    g.add((pnode, OWL['sameAs'], opnode))
-
-        for principal in contributors:
-            p = user_info(context, principal)
-            url = p.get('url')
-            opnode = None
-            if not url:
-                if principal in self.authority:
-                    username, url = self.authority.get(principal)
-                    if username and not url:
-                        url = "https://pleiades.stoa.org/author/" + username
-            if url:
-                old_url = url.replace('https://', 'http://')
-                pnode = URIRef(url)
-                opnode = URIRef(old_url)
-            else:
-                pnode = BNode()
-                opnode = None
-            g.add((subj, DCTERMS['contributor'], pnode))
-            if not url and p.get('fullname'):
-                g.add((pnode, RDF.type, FOAF['Person']))
-                g.add((pnode, FOAF['name'], Literal(p.get('fullname'))))
-                if opnode:
-                    g.add((pnode, OWL['sameAs'], opnode))
+        for term, names in (
+                ('creator', creators), ('contributor', contributors)):
+            for principal in names:
+                p = principal_cache.principal(context, principal)
+                url = p.get('url')
+                if url:
+                    pnode = URIRef(url)
+                else:
+                    pnode = BNode()
+                g.add((subj, DCTERMS[term], pnode))
+                if not url and p.get('fullname'):
+                    g.add((pnode, RDF.type, FOAF['Person']))
+                    g.add((pnode, FOAF['name'], Literal(p.get('fullname'))))
 
         return g
 
 
 class PlaceGrapher(PleiadesGrapher):
+    """Makes the graphs of places.
 
-    def link(self, context):
-        g = place_graph()
+    The triples of a place are added to a new rdflib graph, or to the
+    g argument of place() and link(), which may be any sink of triples
+    with a Graph-like add() method, such as NTriplesSink.
+    """
+
+    def link(self, context, g=None):
+        if g is None:
+            g = place_graph()
         place_url = self.public_url(context)
         context_subj = URIRef(place_url + "#this")
 
@@ -284,21 +812,19 @@ class PlaceGrapher(PleiadesGrapher):
 
         return g
 
+    @profiled('temporal')
     def temporal(self, context, g, subj, vocabs=True):
-        periods = get_vocabulary('time_periods')
-        periods = dict([(p['id'], p) for p in periods])
-        purl = urljoin(self.portal_url, '/vocabularies/time-periods')
-
         for attestation in context.getAttestations():
-            turl = urljoin(purl, attestation['timePeriod'])
+            period = attestation['timePeriod']
             g.add((
                 subj,
                 PLEIADES['during'],
-                URIRef(turl)))
+                vocab_index.term_ref(self.portal_url, 'time-periods', period)))
 
             if vocabs:
-                g = RegVocabGrapher(self.portal, self.request).concept(
-                    'time-periods', periods[attestation['timePeriod']], g)
+                for triple in vocab_index.concept(
+                        self.portal_url, 'time-periods', period):
+                    g.add(triple)
 
         span = TimeSpanWrapper(context).timeSpan
         if span:
@@ -313,12 +839,14 @@ class PlaceGrapher(PleiadesGrapher):
 
         return g
 
+    @profiled('provenance')
     def provenance(self, context, g, subj):
         pnode = BNode()
         g.add((subj, PROV['wasDerivedFrom'], pnode))
         g.add((pnode, RDFS['label'], Literal(context.getInitialProvenance())))
         return g
 
+    @profiled('references')
     def references(self, context, g, subj):
         mapping = {
             'seeAlso': 'citesAsRelated', 'seeFurther': 'citesForInformation'}
@@ -351,9 +879,67 @@ class PlaceGrapher(PleiadesGrapher):
 
         return g
 
-    def place(self, context, vocabs=True):
-        """Create a graph centered on a Place and its Feature."""
-        g = place_graph()
+    @profiled('catalog')
+    def children(self, paths):
+        """Find the published Names and Locations of many places with one
+        catalog query.
+
+        Returns a dict mapping the path of each place to a dict of
+        brains by portal type.
+        """
+        paths = list(paths)
+        if not paths:
+            return {}
+        children = {}
+        for b in self.catalog(
+                path={'query': paths, 'depth': 1},
+                portal_type=['Name', 'Location'],
+                review_state='published'):
+            parent = b.getPath().rsplit('/', 1)[0]
+            children.setdefault(parent, {}).setdefault(
+                b.portal_type, []).append(b)
+        return children
+
+    @profiled('catalog')
+    def connections(self, uids):
+        """Find the published places that many places connect with,
+        without waking any of them: one reference catalog query for the
+        targets of their connections and one portal catalog query for
+        the published ones.
+
+        Returns a dict mapping the UID of each place to a list of
+        brains of its connected places.
+        """
+        connected = connected_uids(self.context, list(uids))
+        targets = set(uid for v in connected.values() for uid in v)
+        if not targets:
+            return {}
+        brains = dict((b.UID, b) for b in self.catalog(
+            UID=list(targets), review_state='published'))
+        return dict(
+            (uid, [brains[t] for t in v if t in brains])
+            for uid, v in connected.items())
+
+    def geometry(self, ob):
+        """Get the LocationGeometry of a Location, or None if it has no
+        geometry or it can't be computed."""
+        try:
+            return location_geometries.geometry(ob)
+        except:
+            log.exception("Couldn't wrap and graph %r", ob)
+            return None
+
+    @profiled('place')
+    def place(self, context, vocabs=True, children=None, connections=None,
+              g=None):
+        """Create a graph centered on a Place and its Feature.
+
+        Brains of the published Names and Locations, as found by
+        children(), and of the published connected places, as found by
+        connections(), may be passed in to save catalog queries.
+        """
+        if g is None:
+            g = place_graph()
         purl = self.public_url(context)
         portal_url = self.portal_url
 
@@ -368,7 +954,7 @@ class PlaceGrapher(PleiadesGrapher):
         g.add((
             context_subj,
             SKOS['inScheme'],
-            URIRef("https://pleiades.stoa.org/places")))
+            PLACES_SCHEME))
 
         # Triples concerning the real world ancient place.
         g.add((feature_subj, RDF.type, SPATIAL['Feature']))
@@ -400,31 +986,28 @@ class PlaceGrapher(PleiadesGrapher):
 
         # Place or feature types
 
-        place_types = get_vocabulary('place_types')
-        place_types = dict([(t['id'], t) for t in place_types])
-        url = urljoin(portal_url, '/vocabularies/place-types')
+        place_types = vocab_index.terms('place-types')
         pcats = set(filter(None, context.getPlaceType()))
         for pcat in pcats:
-            item = place_types.get(pcat)
-            if not item:
+            if pcat not in place_types:
                 continue
-            iurl = urljoin(url, pcat)
             g.add((
                 context_subj,
                 PLEIADES['hasFeatureType'],
-                URIRef(iurl)))
+                vocab_index.term_ref(portal_url, 'place-types', pcat)))
 
             if vocabs:
-                g = RegVocabGrapher(self.portal, self.request).concept(
-                    'place-types', place_types[pcat], g)
+                for triple in vocab_index.concept(
+                        portal_url, 'place-types', pcat):
+                    g.add(triple)
 
         # Names as skos:label and prefLabel
-        folder_path = "/".join(context.getPhysicalPath())
-        brains = self.catalog(
-            path={'query': folder_path, 'depth': 1},
-            portal_type='Name',
-            review_state='published')
-        names = [b.getObject() for b in brains]
+        started = profiler.start()
+        if children is None:
+            folder_path = "/".join(context.getPhysicalPath())
+            children = self.children([folder_path]).get(folder_path, {})
+        brains = children.get('Name', [])
+        names = [get_object(b) for b in brains]
 
         for obj in names:
             name = Literal(
@@ -458,30 +1041,29 @@ class PlaceGrapher(PleiadesGrapher):
             for nr in obj.getNameTransliterated().split(','):
                 nr = nr.strip()
                 g.add((name_subj, PLEIADES['nameRomanized'], Literal(nr)))
+        profiler.stop('names', started)
 
         # representative point
+        started = profiler.start()
         xs = []
         ys = []
-        folder_path = "/".join(context.getPhysicalPath())
-        brains = self.catalog(
-            path={'query': folder_path, 'depth': 1},
-            portal_type='Location',
-            review_state='published')
-        locs = [b.getObject() for b in brains]
-        features = [wrap(ob, 0) for ob in locs]
+        brains = children.get('Location', [])
+        locs = [get_object(b) for b in brains]
+        geometries = {}
 
         # get representative point
         loc_prec = location_precision(context)
         if loc_prec == 'precise':
-            repr_point = None
-            for f in features:
-                if f.geometry and hasattr(f.geometry, '__geo_interface__'):
-                    shape = asShape(f.geometry)
-                    b = shape.bounds
-                    xs.extend([b[0], b[2]])
-                    ys.extend([b[1], b[3]])
-                    if repr_point is None:
-                        repr_point = shape.centroid
+            for ob in locs:
+                geometries[ob.getId()] = self.geometry(ob)
+            located = [
+                geometries[ob.getId()] for ob in locs
+                if geometries[ob.getId()] is not None]
+            for geometry in located:
+                b = geometry.bounds
+                xs.extend([b[0], b[2]])
+                ys.extend([b[1], b[3]])
+            repr_point = located and located[0].centroid
             if len(xs) * len(ys) > 0:
                 bbox = [min(xs), min(ys), max(xs), max(ys)]
             else:
@@ -491,11 +1073,11 @@ class PlaceGrapher(PleiadesGrapher):
                 g.add((
                     context_subj,
                     GEO['lat'],
-                    Literal(repr_point.y)))
+                    Literal(repr_point[1])))
                 g.add((
                     context_subj,
                     GEO['long'],
-                    Literal(repr_point.x)))
+                    Literal(repr_point[0])))
             elif bbox:
                 g.add((
                     context_subj,
@@ -528,26 +1110,15 @@ class PlaceGrapher(PleiadesGrapher):
                                 OSSPATIAL['within'],
                                 URIRef(grid_uri)))
 
-                            e = URIRef(grid_uri + "-extent")  # the grid's extent
-                            g.add((e, RDF.type, OSGEO['AbstractGeometry']))
-                            g.add((
-                                URIRef(grid_uri),
-                                OSGEO['extent'],
-                                e))
-                            bounds = capgrids.box(mapnum, grid)
-                            shape = box(*bounds)
-                            g.add((
-                                e,
-                                OSGEO['asGeoJSON'],
-                                Literal(geojson.dumps(shape))))
-                            g.add((
-                                e,
-                                OSGEO['asWKT'],
-                                Literal(wkt.dumps(shape))))
+                            # the grid's extent
+                            for triple in grid_extents.extent(mapnum, grid):
+                                g.add(triple)
                     except (ValueError, TypeError):
                         log.exception("Exception caught computing grid extent for %r", loc)
+        profiler.stop('representative point', started)
 
         # Locations
+        started = profiler.start()
         for obj in locs:
 
             locn_subj = URIRef(urljoin(context_page, obj.getId()))
@@ -585,57 +1156,46 @@ class PlaceGrapher(PleiadesGrapher):
 
                     for grid in grids:
                         grid_uri = gridbase + mapnum + "#" + (grid or "this")
-                        bounds = capgrids.box(mapnum, grid)
-                        shape = box(*bounds)
+                        extent = grid_extents.extent(mapnum, grid)
 
                         g.add((
                             locn_subj,
                             OSSPATIAL['partiallyOverlaps'],
                             URIRef(grid_uri)))
 
-                        e = URIRef(grid_uri + "-extent") # the grid's extent
-                        g.add((e, RDF.type, OSGEO['AbstractGeometry']))
-                        g.add((
-                            URIRef(grid_uri),
-                            OSGEO['extent'],
-                            e))
-                        g.add((
-                            e,
-                            OSGEO['asGeoJSON'],
-                            Literal(geojson.dumps(shape))))
-                        g.add((
-                            e,
-                            OSGEO['asWKT'],
-                            Literal(wkt.dumps(shape))))
+                        # the grid's extent
+                        for triple in extent:
+                            g.add(triple)
 
                 except:
                     log.exception("Exception caught computing grid extent for %r", obj)
 
             else:
-                try:
-                    f = wrap(obj, 0)
-                    if (f.geometry and
-                            hasattr(f.geometry, '__geo_interface__')):
-                        shape = asShape(f.geometry)
-                        g.add((
-                            locn_subj,
-                            OSGEO['asGeoJSON'],
-                            Literal(geojson.dumps(shape))))
-                        g.add((
-                            locn_subj,
-                            OSGEO['asWKT'],
-                            Literal(wkt.dumps(shape))))
-                except:
-                    log.exception("Couldn't wrap and graph %r", obj)
+                if obj.getId() not in geometries:
+                    geometries[obj.getId()] = self.geometry(obj)
+                geometry = geometries[obj.getId()]
+                if geometry is not None:
+                    g.add((
+                        locn_subj,
+                        OSGEO['asGeoJSON'],
+                        Literal(geometry.geojson)))
+                    g.add((
+                        locn_subj,
+                        OSGEO['asWKT'],
+                        Literal(geometry.wkt)))
+        profiler.stop('locations', started)
 
         # connects with
-        for f in context.getConnectedPlaces():
-            if self.wftool.getInfoFor(f, 'review_state') != 'published':
-                continue
-            furl = self.public_url(f)
+        started = profiler.start()
+        if connections is None:
+            uid = context.UID()
+            connections = self.connections([uid]).get(uid, [])
+        for b in connections:
+            furl = self.unrooted(b.getURL())
             feature_obj = URIRef(furl + "#this")
             g.add((feature_subj, SPATIAL['C'], feature_obj))
             g.add((context_subj, RDFS['seeAlso'], URIRef(furl)))
+        profiler.stop('connections', started)
 
         # dcterms:coverage
         coverage = geoContext(context)
@@ -712,43 +1272,9 @@ class RegVocabGrapher(PleiadesGrapher):
 
     def concept(self, vocab_name, term, g):
         """Return a set of tuples representing the term"""
-        vurl = urljoin(self.portal_url, '/vocabularies/', vocab_name)
-        turl = urljoin(vurl, term['id'])
-        term_ref = URIRef(turl)
-        label = term['title']
-        note = term['description']
-        same_as = term['same_as']
-
-        g.add((
-            term_ref,
-            RDF.type,
-            SKOS['Concept']))
-        g.add((
-            term_ref,
-            SKOS['prefLabel'],
-            Literal(label, "en")))
-
-        if note:
-            g.add((
-                term_ref,
-                SKOS['scopeNote'],
-                Literal(note, "en")))
-
-        if same_as:
-            g.add((
-                term_ref,
-                OWL['sameAs'],
-                URIRef(same_as)))
-
-        g.add((
-            term_ref,
-            SKOS['inScheme'],
-            URIRef(vurl)))
-
-        orig_url = turl.replace('https://', 'http://')
-        if orig_url and orig_url != turl:
-            g.add((URIRef(turl), OWL['sameAs'], URIRef(orig_url)))
-
+        for triple in vocab_index.concept(
+                self.portal_url, vocab_name, term['id']):
+            g.add(triple)
         return g
 
     def scheme(self, vocab_name):
@@ -775,9 +1301,7 @@ class RegVocabGrapher(PleiadesGrapher):
         if orig_url and orig_url != vurl:
             g.add((URIRef(vurl), OWL['sameAs'], URIRef(orig_url)))
 
-        key = vocab_name.replace('-', '_')
-        vocab = get_vocabulary(key)
-        for term in vocab:
+        for term in vocab_index.vocabulary(vocab_name):
             g = self.concept(vocab_name, term, g)
 
         return g
@@ -798,10 +1322,16 @@ class PersonsGrapher(PleiadesGrapher):
             if u in users:
                 users.remove(u)
 
+        # Members are read at once, or taken from the map in use for
+        # the dcterms of places.
+        members = principal_cache.members
+        if members is None:
+            members = MemberMap.load(context)
+
         # First, the Pleiades site contributors.
         for u in users:
 
-            info = user_info(context, u)
+            info = members.user_info(context, u)
             fullname = info.get('fullname')
 
             # Site users.
@@ -813,6 +1343,10 @@ class PersonsGrapher(PleiadesGrapher):
                 if fullname in self.authority:
                     username, uri = self.authority[fullname]
                     g.add((subj, OWL['sameAs'], URIRef(uri)))
+                else:
+                    row = self.authority.by_username(info['id'])
+                    if row and row[2]:
+                        g.add((subj, OWL['sameAs'], URIRef(row[2])))
 
             # Non-user authors listed in the authority file.
             elif u in self.authority:
@@ -823,7 +1357,7 @@ class PersonsGrapher(PleiadesGrapher):
                     continue
                 subj = URIRef(uri)
                 g.add((subj, RDF.type, FOAF['Person']))
-                g.add((subj, FOAF['name'], Literal(label)))
+                g.add((subj, FOAF['name'], Literal(u)))
                 old_uri = uri.replace('https://', 'http://')
                 g.add((URIRef(uri), OWL['sameAs'], URIRef(old_uri)))
 
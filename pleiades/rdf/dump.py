@@ -1,13 +1,22 @@
 # Run as a script, this dumps all published places to N3 RDF
 
+import atexit
+import hashlib
+import json
 import logging
+import os
+import shutil
 import sys
+import tempfile
 from optparse import OptionParser
 
 import transaction
 from AccessControl.SecurityManagement import newSecurityManager
 from AccessControl.SecurityManager import setSecurityPolicy
 from DateTime import DateTime
+from rdflib import plugin
+from rdflib.plugin import PluginException
+from rdflib.serializer import Serializer
 from Products.CMFCore.tests.base.security import PermissiveSecurityPolicy
 from Products.CMFCore.tests.base.security import OmnipotentUser
 from Products.CMFCore.utils import getToolByName
@@ -15,16 +24,384 @@ from Testing.makerequest import makerequest
 
 from pleiades.dump import secure, getSite, spoofRequest
 from pleiades.rdf.common import PlaceGrapher, PersonsGrapher, VocabGrapher, RegVocabGrapher
-from pleiades.rdf.common import place_graph
+from pleiades.rdf.common import MemberMap, grid_extents, place_graph
+from pleiades.rdf.common import location_geometries, principal_cache
+from pleiades.rdf.common import connected_uids, profiler
+from pleiades.rdf.memory import memory_policy
+from pleiades.rdf.shards import run_shards, split_ids
+from pleiades.rdf.store import Checkpoint, PlaceStore
+from pleiades.rdf.stream import HEADER, NTriplesSink, NTriplesStream
+from pleiades.rdf.stream import COMPRESSIONS, ChunkedNTriplesStream
+from pleiades.rdf.stream import TurtleStream
+from pleiades.rdf.stream import is_complete, open_output
 from pleiades.vocabularies.vocabularies import get_vocabulary
 
 COMMIT_THRESHOLD = 50
+CHECKPOINT_INTERVAL = 500
+
+# File name extensions of the formats that can be written with --formats.
+# N-Triples and Turtle are written as places are graphed, the others at the
+# end of the dump.
+FORMATS = {'nt': '.nt', 'turtle': '.ttl', 'xml': '.rdf', 'json-ld': '.jsonld'}
+STREAM_FORMATS = {'nt': NTriplesStream, 'turtle': TurtleStream}
+
+# Suffixes of the files next to the output of a shard (--shard) to which
+# it saves its grid extents and location geometries, merged by
+# dump_sharded().
+GRID_CACHE_SUFFIX = '.grid.json'
+GEOMETRY_CACHE_SUFFIX = '.geometry.json'
+
+log = logging.getLogger('pleiades.rdf')
+
+
+def place_graphs(site, app, brains, sink=None):
+    """Generate (brain, graph) pairs for the places and links found by
+    a catalog search, one at a time. The graph is None if it could not
+    be made.
+
+    Places are processed in batches, and the names and locations of a
+    batch, and the places connected to it, are found with a few catalog
+    queries. If a sink is given, the triples of every place are added to
+    it instead of to a new graph, and it is yielded in place of the
+    graph. After each batch the objects it woke are released according
+    to the memory policy.
+    """
+    grapher = PlaceGrapher(site, app)
+    for batch in batches(brains, COMMIT_THRESHOLD):
+        places = [b for b in batch if b.portal_type == 'Place']
+        children = grapher.children([b.getPath() for b in places])
+        connections = grapher.connections([b.UID for b in places])
+        for b in batch:
+            profiler.begin(b.getId)
+            obj = b.getObject()
+            g = None
+            if sink is not None:
+                sink.reset()
+            try:
+                if b.portal_type == 'Place':
+                    g = grapher.place(
+                        obj, vocabs=False,
+                        children=children.get(b.getPath(), {}),
+                        connections=connections.get(b.UID, []), g=sink)
+                elif b.portal_type == 'Link':
+                    g = grapher.link(obj, g=sink)
+            except Exception, e:
+                log.exception("Failed to add object graph of %r to dump batch: %s", obj, e)
+            yield b, g
+            profiler.end()
+        transaction.commit()
+        memory_policy.collect(site._p_jar)
+
+
+def batches(items, size):
+    """Generate lists of up to size items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def open_writer(out, contents, chunks=None, checkpoint=None):
+    """Get an N-Triples stream writing to out, or, if chunks is a dict
+    of ChunkedNTriplesStream arguments, a stream of chunk files. A
+    stream is continued from the state of a loaded checkpoint."""
+    if chunks:
+        return ChunkedNTriplesStream(contents=contents, **chunks)
+    state = checkpoint is not None and checkpoint.state or None
+    if state is not None and state['contents'] != contents:
+        raise ValueError(
+            "Checkpoint is of a dump of %s, not %s" % (
+                state['contents'], contents))
+    return NTriplesStream(out, contents, state=state)
+
+
+def dump_places(site, app, brains, contents, out, stream=False,
+                direct=False, chunks=None, checkpoint=None, outputs=None):
+    """Write the graphs of places to out, either as a single Turtle
+    document or as a stream of N-Triples.
+
+    If direct is true, triples are streamed as they are made, without
+    building rdflib graphs. The triples of a place that fails part way
+    are then left in the stream. A stream may be written in chunks
+    instead of to out (see open_writer).
+
+    A stream to a file may be checkpointed. If the checkpoint has a
+    saved state, places up to and including its last are skipped.
+
+    If outputs is given, graphs are written in several formats instead
+    (see dump_formats).
+    """
+    if outputs:
+        dump_formats(site, app, brains, contents, outputs)
+        return
+    if checkpoint is not None and checkpoint.state is not None:
+        last = checkpoint.state['last']
+        brains = [b for b in brains if b.getId > last]
+        log.info("Resuming dump after %s", last)
+    if stream and direct:
+        writer = open_writer(out, contents, chunks, checkpoint)
+        sink = NTriplesSink(writer)
+        for b, g in place_graphs(site, app, brains, sink=sink):
+            writer.boundary()
+            if checkpoint is not None:
+                checkpoint.update(writer, contents, b.getId)
+        writer.close()
+        if checkpoint is not None:
+            checkpoint.remove()
+    elif stream:
+        writer = open_writer(out, contents, chunks, checkpoint)
+        for b, g in place_graphs(site, app, brains):
+            if g is not None:
+                started = profiler.start()
+                writer.write(g)
+                profiler.stop('serialize', started)
+                writer.boundary()
+            if checkpoint is not None:
+                checkpoint.update(writer, contents, b.getId)
+        writer.close()
+        if checkpoint is not None:
+            checkpoint.remove()
+    else:
+        g = place_graph()
+        for b, pg in place_graphs(site, app, brains):
+            if pg is not None:
+                g += pg
+        dump_graph(g, contents, out)
+    log.info(
+        "Principal cache: %(hits)d hits, %(misses)d misses, %(size)d entries",
+        principal_cache.stats())
+    log.info(
+        "Memory: %(batches)d batches, cache minimized %(minimized)d times, "
+        "peak %(peak_objects)d objects in cache, peak RSS %(peak_rss)d bytes",
+        memory_policy.stats())
+
+
+def dump_formats(site, app, brains, contents, outputs):
+    """Write the graphs of places in several formats at once, making
+    each graph only once. outputs maps format names to files.
+
+    Streamed formats are written as places are graphed. If there are
+    others, the graphs are also merged into one that is serialized in
+    each of them at the end.
+    """
+    writers = []
+    merged = None
+    for format, out in sorted(outputs.items()):
+        if format in STREAM_FORMATS:
+            writers.append(STREAM_FORMATS[format](out, contents))
+        elif merged is None:
+            merged = place_graph()
+    for b, g in place_graphs(site, app, brains):
+        if g is None:
+            continue
+        started = profiler.start()
+        for writer in writers:
+            writer.write(g)
+            writer.boundary()
+        profiler.stop('serialize', started)
+        if merged is not None:
+            merged += g
+    for writer in writers:
+        writer.close()
+    for format, out in sorted(outputs.items()):
+        if format not in STREAM_FORMATS:
+            started = profiler.start()
+            merged.serialize(destination=out, format=format)
+            profiler.stop('serialize', started)
+            out.flush()
+
+
+def dump_sharded(brains, contents, out, jobs, command, option='-p'):
+    """Dump places in parallel worker processes, one per shard of the
+    place ids, and merge their N-Triples into out."""
+    ranges = split_ids([b.getId for b in brains], jobs)
+    directory = tempfile.mkdtemp(prefix='pleiades-rdf-')
+    paths = run_shards(command, ranges, directory, option=option)
+    failed = [p for p in paths if not os.path.exists(p) or not is_complete(p)]
+    if failed:
+        raise RuntimeError(
+            "Dump shards failed, see %s: %s" % (directory, ", ".join(failed)))
+    for path in paths:
+        load_shard_caches(path)
+    writer = NTriplesStream(out, contents)
+    writer.merge(paths)
+    writer.close()
+    shutil.rmtree(directory)
+
+
+def load_shard_caches(path):
+    """Merge the caches saved by the shard whose output is path into
+    those of this process, which alone saves them to the shared files."""
+    if os.path.exists(path + GRID_CACHE_SUFFIX):
+        grid_extents.load(path + GRID_CACHE_SUFFIX)
+    if os.path.exists(path + GEOMETRY_CACHE_SUFFIX):
+        location_geometries.load(path + GEOMETRY_CACHE_SUFFIX)
+
+
+def dump_incremental(site, app, store, out, chunks=None):
+    """Update a store of place graphs with the published places whose
+    stored graphs are missing or stale, and write all stored places to
+    out as N-Triples.
+
+    Staleness is found by the versions of places (see place_versions),
+    which change when a place, its names and locations, or the places
+    it connects with are modified, published, retracted, or removed.
+    Places that could not be graphed keep their stale versions and are
+    retried by the next dump.
+    """
+    brains = site['portal_catalog'].searchResults(
+        path={'query': "/plone/places"},
+        portal_type=['Place', 'Link'],
+        review_state='published',
+        sort_on='getId')
+    versions = place_versions(site, brains)
+    for pid in store.ids():
+        if pid not in versions:
+            store.delete(pid)
+    update_stale(site, app, store, brains, versions)
+    write_store(store, out, "Pleiades Places", chunks)
+
+
+def update_store(site, app, store, brains, section='places', versions=None):
+    """Graph places into a store and commit it, returning the ids of the
+    places that could not be graphed. Places are stored with their
+    versions, as found by place_versions(), if given."""
+    versions = versions or {}
+    failures = []
+    for b, g in place_graphs(site, app, brains):
+        if g is None:
+            failures.append(b.getId)
+        else:
+            started = profiler.start()
+            modified, source = versions.get(b.getId, (None, None))
+            store.put(
+                b.getId, g.serialize(format='nt'), section=section,
+                modified=modified, source=source)
+            profiler.stop('serialize', started)
+    store.commit()
+    return failures
+
+
+def place_versions(site, brains):
+    """Get the (latest modification date, source fingerprint) of places by
+    id. The fingerprint is a digest of the ids, review states, and
+    modification dates of a place and its names and locations, and of
+    the UIDs, paths, review states, and modification dates of the places
+    it connects with, so that a place is regraphed when one of them is
+    published, retracted, moved, or deleted. They are
+    found with a few catalog queries per batch of places."""
+    catalog = site['portal_catalog']
+    versions = {}
+    for batch in batches(brains, 10 * COMMIT_THRESHOLD):
+        parts = dict((b.getPath(), [b]) for b in batch)
+        for b in catalog.searchResults(
+                path={'query': list(parts), 'depth': 1},
+                portal_type=['Name', 'Location']):
+            parts[b.getPath().rsplit('/', 1)[0]].append(b)
+        connected = connected_uids(site, [b.UID for b in batch])
+        related = set(uid for v in connected.values() for uid in v)
+        others = {}
+        if related:
+            for b in catalog.searchResults(UID=list(related)):
+                others[b.UID] = (
+                    b.getPath(), b.review_state,
+                    DateTime(b.modified).ISO8601())
+        for items in parts.values():
+            modified = max(DateTime(b.modified) for b in items)
+            source = sorted(
+                (b.getId, b.review_state, DateTime(b.modified).ISO8601())
+                for b in items)
+            source.extend(sorted(
+                (uid, others.get(uid))
+                for uid in connected.get(items[0].UID, ())))
+            versions[items[0].getId] = (
+                modified.ISO8601(), hashlib.sha1(repr(source)).hexdigest())
+    return versions
+
+
+def dump_stored(site, app, store, brains, contents, out, query,
+                ranged=False, section='places', chunks=None):
+    """Write the places found by a catalog search as N-Triples assembled
+    from a store, first regraphing the places whose stored graphs are
+    missing or stale.
+
+    query is the list of ids, or the first and last ids of the range,
+    that the places were found by. Stored places that it selects but
+    that weren't found, because they are no longer published, are
+    dropped from the store.
+    """
+    versions = place_versions(site, brains)
+    sources = store.sources(section)
+    if ranged:
+        first, last = query[0], query[-1]
+        selected = [pid for pid in sources if first <= pid <= last]
+    else:
+        first, last = min(query), max(query)
+        selected = [pid for pid in query if pid in sources]
+    for pid in selected:
+        if pid not in versions:
+            store.delete(pid, section=section)
+    update_stale(site, app, store, brains, versions, section)
+
+    writer = open_writer(out, contents, chunks)
+    for pid, triples in store.items(section, first, last, versions):
+        writer.write_lines(triples.splitlines(True))
+        writer.boundary()
+    writer.close()
+
+
+def update_stale(site, app, store, brains, versions, section='places'):
+    """Regraph the places whose stored graphs are missing or whose
+    stored sources differ from their versions, as found by
+    place_versions(). Places that could not be graphed keep their stored
+    graphs, if any."""
+    sources = store.sources(section)
+    stale = [b for b in brains if sources.get(b.getId) != versions[b.getId][1]]
+    log.info("Regraphing %d of %d places", len(stale), len(versions))
+    failures = update_store(
+        site, app, store, stale, section=section, versions=versions)
+    if failures:
+        log.warn(
+            "Failed to graph %d places, dumping their stored graphs: %s",
+            len(failures), ", ".join(failures))
+
+
+def write_store(store, out, contents, chunks=None):
+    """Write all stored places to out, or in chunks, as N-Triples."""
+    writer = open_writer(out, contents, chunks)
+    for pid, triples in store.items():
+        writer.write_lines(triples.splitlines(True))
+        writer.boundary()
+    writer.close()
+
+
+def dump_graph(g, contents, out):
+    out.write(HEADER % (contents, DateTime()))
+    out.write("# Triple count: %d\n\n" % len(g))
+    started = profiler.start()
+    out.write(g.serialize(format='turtle'))
+    profiler.stop('serialize', started)
+    out.flush()
+
+
+def write_profile(path):
+    """Write a summary of the profiled stages to stderr and the complete
+    profile to a JSON file."""
+    sys.stderr.write(profiler.summary())
+    f = open(path, 'w')
+    try:
+        json.dump(profiler.profile(), f, indent=2)
+    finally:
+        f.close()
+
 
 if __name__ == '__main__':
     from os import environ
 
-    log = logging.getLogger('pleiades.rdf')
-
     parser = OptionParser()
     parser.add_option(
         "-u", "--user", dest="user",
@@ -51,11 +428,114 @@ if __name__ == '__main__':
         default=False,
         action='store_true',
         help='Interpret places as a range. Example: "-p=1,3 -r" dumps all places starting with "1" and up to but not including "3" or higher')
+    parser.add_option(
+        "-s", "--stream", dest="stream",
+        default=False,
+        action='store_true',
+        help="Write places as N-Triples as each place graph is made instead of as a single Turtle document")
+    parser.add_option(
+        "-d", "--direct", dest="direct",
+        default=False,
+        action='store_true',
+        help="With -s, write N-Triples as they are made, without building rdflib graphs")
+    parser.add_option(
+        "-o", "--output", dest="output",
+        default=None,
+        help="Write the dump to a file instead of stdout")
+    parser.add_option(
+        "-f", "--formats", dest="formats",
+        default=None,
+        help="Comma separated formats (nt, turtle, xml, json-ld) to write places in at once, with -o naming the files: places.nt gives places.ttl, places.rdf, etc. json-ld requires rdflib-jsonld")
+    parser.add_option(
+        "-z", "--compress", dest="compress",
+        default=None,
+        choices=sorted(COMPRESSIONS),
+        help="Compress the dump with gzip, bz2, or zstd (zstd requires the zstandard package)")
+    parser.add_option(
+        "--chunk-places", dest="chunk_places",
+        default=None,
+        type='int',
+        help="With -s and -o, write N-Triples in files of about this many places each, listed in a manifest")
+    parser.add_option(
+        "--chunk-bytes", dest="chunk_bytes",
+        default=None,
+        type='int',
+        help="With -s and -o, write N-Triples in files of about this many (uncompressed) bytes each, listed in a manifest")
+    parser.add_option(
+        "--checkpoint-every", dest="checkpoint_every",
+        default=None,
+        type='int',
+        help="With -s and -o, save the progress of the dump every this many places to the output file name plus '.checkpoint'")
+    parser.add_option(
+        "--resume", dest="resume",
+        default=False,
+        action='store_true',
+        help="Resume an interrupted dump (-s -o) from its checkpoint, appending to its output")
+    parser.add_option(
+        "-j", "--jobs", dest="jobs",
+        default=1,
+        type='int',
+        help="Split a range of places into this many shards, dumped in parallel by separate processes and merged as N-Triples")
+    parser.add_option(
+        "--instance", dest="instance",
+        default="bin/instance",
+        help="Zope instance script used to run shard processes")
+    parser.add_option(
+        "--shard", dest="shard",
+        default=False,
+        action='store_true',
+        help="Save caches next to the output, for the dump that started this shard process to merge (set by -j)")
+    parser.add_option(
+        "--grid-cache", dest="grid_cache",
+        default=None,
+        help="Load and save computed BAtlas grid extents in this file")
+    parser.add_option(
+        "--geometry-cache", dest="geometry_cache",
+        default=None,
+        help="Load and save computed location geometries in this file, recomputing them only for modified locations")
+    parser.add_option(
+        "--geometry-cache-size", dest="geometry_cache_size",
+        default=100000,
+        type='int',
+        help="Most location geometries to keep in the --geometry-cache, dropping the least recently used")
+    parser.add_option(
+        "--members", dest="members",
+        default=False,
+        action='store_true',
+        help="Read all site members at once and resolve creators and contributors from them instead of looking each up")
+    parser.add_option(
+        "--minimize-cache", dest="minimize_cache",
+        default=False,
+        action='store_true',
+        help="Turn all objects in the ZODB cache back into ghosts after every batch of places")
+    parser.add_option(
+        "--max-rss", dest="max_rss",
+        default=None,
+        type='int',
+        help="Minimize the ZODB cache after a batch of places if the process uses more than this many megabytes")
+    parser.add_option(
+        "--memory-report", dest="memory_report",
+        default=False,
+        action='store_true',
+        help="Log the size of the ZODB cache and the process after every batch of places")
+    parser.add_option(
+        "--profile", dest="profile",
+        default=None,
+        help="Time the stages of graph building, writing a summary to stderr and a JSON profile to this file")
+    parser.add_option(
+        "-i", "--incremental", dest="incremental",
+        default=False,
+        action='store_true',
+        help="Regraph only places whose graphs are missing from a store of place graphs (--store) or stale, and dump all stored places as N-Triples")
+    parser.add_option(
+        "--store", dest="store",
+        default=None,
+        help="Database file of place graphs. With -i, for incremental dumps. With -p or -e and -s, dumps are assembled from it, regraphing only places changed since they were stored")
 
     opts, args = parser.parse_args(sys.argv[1:])
 
-    if (int(bool(opts.authors)) + int(bool(opts.vocabulary)) + int(bool(opts.places))) > 1:
-        raise ValueError("-a, -p, and -v options are exclusive")
+    if (int(bool(opts.authors)) + int(bool(opts.vocabulary)) + int(bool(opts.places)) + int(opts.incremental)) > 1:
+        raise ValueError("-a, -i, -p, and -v options are exclusive")
 
     app = spoofRequest(app)
     server_name = environ.get('SERVER_NAME', 'pleiades.stoa.org').strip()
@@ -67,20 +547,128 @@ if __name__ == '__main__':
     app.REQUEST.other['VirtualRootPhysicalPath'] = vh_root
 
     site = getSite(app)
-    count = 0
+    catalog = site['portal_catalog']
+
+    if opts.shard and not opts.output:
+        raise ValueError("--shard requires an output (-o)")
+
+    command = [opts.instance, 'run', sys.argv[0], '--shard']
+    if opts.direct:
+        command.append('--direct')
+    if opts.members:
+        command.append('--members')
+    if opts.minimize_cache:
+        command.append('--minimize-cache')
+    if opts.max_rss:
+        command.extend(['--max-rss', str(opts.max_rss)])
+    if opts.memory_report:
+        command.append('--memory-report')
+    if opts.grid_cache:
+        command.extend(['--grid-cache', opts.grid_cache])
+        if os.path.exists(opts.grid_cache):
+            grid_extents.load(opts.grid_cache)
+        if opts.shard:
+            atexit.register(
+                grid_extents.save, opts.output + GRID_CACHE_SUFFIX)
+        else:
+            atexit.register(grid_extents.save, opts.grid_cache)
+    if opts.geometry_cache:
+        command.extend([
+            '--geometry-cache', opts.geometry_cache,
+            '--geometry-cache-size', str(opts.geometry_cache_size)])
+        location_geometries.keep = True
+        location_geometries.maxsize = opts.geometry_cache_size
+        if os.path.exists(opts.geometry_cache):
+            location_geometries.load(opts.geometry_cache)
+        if opts.shard:
+            atexit.register(
+                location_geometries.save, opts.output + GEOMETRY_CACHE_SUFFIX)
+        else:
+            atexit.register(location_geometries.save, opts.geometry_cache)
+
+    if opts.members:
+        principal_cache.use_members(MemberMap.load(site))
+        log.info("Read %d members", len(principal_cache.members))
+
+    memory_policy.minimize = opts.minimize_cache
+    memory_policy.max_rss = opts.max_rss and opts.max_rss * 1024 * 1024
+    memory_policy.report = opts.memory_report
+
+    if opts.profile:
+        profiler.enabled = True
+        atexit.register(write_profile, opts.profile)
+
+    chunks = None
+    checkpoint = None
+    outputs = None
+    if opts.formats:
+        formats = [s.strip() for s in opts.formats.split(",")]
+        unknown = [f for f in formats if f not in FORMATS]
+        if unknown:
+            raise ValueError("Unknown formats: %s" % ", ".join(unknown))
+        if (not opts.output or not (opts.places or opts.errata) or
+                opts.stream or opts.jobs > 1 or
+                opts.incremental or opts.chunk_places or opts.chunk_bytes or
+                opts.checkpoint_every or opts.resume):
+            raise ValueError(
+                "--formats requires -p or -e and -o, and can't be used with "
+                "-i, -j, -s, checkpoints, or chunks")
+        if 'json-ld' in formats:
+            try:
+                plugin.get('json-ld', Serializer)
+            except PluginException:
+                raise ValueError("json-ld output requires rdflib-jsonld")
+        root = os.path.splitext(opts.output)[0]
+        outputs = {}
+        for format in formats:
+            outputs[format] = open_output(
+                root + FORMATS[format] + COMPRESSIONS.get(opts.compress, ''),
+                opts.compress)
+            atexit.register(outputs[format].close)
+        out = None
+    elif opts.checkpoint_every or opts.resume:
+        if (not opts.output or not opts.stream or opts.compress or
+                opts.chunk_places or opts.chunk_bytes or opts.jobs > 1 or
+                opts.incremental):
+            raise ValueError(
+                "--checkpoint-every and --resume require -s and -o, and "
+                "can't be used with -i, -j, -z, or chunks")
+        checkpoint = Checkpoint(
+            opts.output + '.checkpoint',
+            opts.checkpoint_every or CHECKPOINT_INTERVAL)
+        if opts.resume and checkpoint.load() is None:
+            log.warn("No checkpoint of %s, starting over", opts.output)
+        out = checkpoint.open(opts.output)
+        atexit.register(out.close)
+    elif opts.chunk_places or opts.chunk_bytes:
+        if (not opts.output or not (opts.stream or opts.incremental) or
+                opts.jobs > 1):
+            raise ValueError(
+                "--chunk-places and --chunk-bytes require -s and -o, and "
+                "can't be used with -j")
+        chunks = {
+            'path': opts.output, 'compression': opts.compress,
+            'max_places': opts.chunk_places, 'max_bytes': opts.chunk_bytes}
+        out = None
+    else:
+        out = open_output(opts.output, opts.compress)
+        if out is not sys.stdout:
+            atexit.register(out.close)
+
+    store = None
+    if opts.store and not opts.incremental:
+        if (not (opts.places or opts.errata) or not opts.stream or
+                opts.jobs > 1 or outputs or checkpoint):
+            raise ValueError(
+                "--store requires -i, or -p or -e and -s, and can't be used "
+                "with -j, --formats, or checkpoints")
+        store = PlaceStore(opts.store)
+        atexit.register(store.close)
 
     if opts.authors:
 
         g = PersonsGrapher(site, app).authors(site)
-        sys.stdout.write("""# Pleiades RDF Dump
-# Contents: Pleiades Authors
-# Date: %s
-# License: http://creativecommons.org/licenses/by/3.0/us/
-# Credits: https://pleiades.stoa.org/credits
-# Triple count: %d
-
-""" % (DateTime(), len(g)))
-        sys.stdout.write(g.serialize(format='turtle'))
+        dump_graph(g, "Pleiades Authors", out)
         sys.exit(1)
 
     elif opts.vocabulary:
@@ -90,139 +678,108 @@ if __name__ == '__main__':
         else:
             vocab = site['vocabularies'][opts.vocabulary]
             g = VocabGrapher(site, app).scheme(vocab)
-        sys.stdout.write("""# Pleiades RDF Dump
-# Contents: Pleiades Vocabulary '%s'
-# Date: %s
-# License: http://creativecommons.org/licenses/by/3.0/us/
-# Credits: https://pleiades.stoa.org/credits
-# Triple count: %d
-
-""" % (opts.vocabulary, DateTime(), len(g)))
-        sys.stdout.write(g.serialize(format='turtle'))
+        dump_graph(g, "Pleiades Vocabulary '%s'" % opts.vocabulary, out)
+        sys.exit(1)
+
+    elif opts.incremental:
+
+        if not opts.store:
+            raise ValueError("-i requires a --store")
+        store = PlaceStore(opts.store)
+        dump_incremental(site, app, store, out, chunks=chunks)
+        store.close()
         sys.exit(1)
 
     elif opts.places and not opts.range:
 
-        g = place_graph()
         pids = [s.strip() for s in opts.places.split(",")]
-        catalog = site['portal_catalog']
-        for b in catalog.searchResults(
-                path={'query': "/plone/places"},
-                portal_type=['Place', 'Link'],
-                review_state='published',
-                getId=pids,
-                sort_on='getId'):
-            obj = b.getObject()
-            try:
-                if b.portal_type == 'Place':
-                    g += PlaceGrapher(site, app).place(obj, vocabs=False)
-                elif b.portal_type == 'Link':
-                    g += PlaceGrapher(site, app).link(obj)
-            except Exception, e:
-                log.exception("Failed to add object graph of %r to dump batch: %s", obj, e)
-            count += 1
-            if count % COMMIT_THRESHOLD == 0:
-                transaction.commit()
-        sys.stdout.write("""# Pleiades RDF Dump
-# Contents: Pleiades Places %s
-# Date: %s
-# License: http://creativecommons.org/licenses/by/3.0/us/
-# Credits: https://pleiades.stoa.org/credits
-# Triple count: %d
-
-""" % (opts.places, DateTime(), len(g)))
-        sys.stdout.write(g.serialize(format='turtle'))
+        brains = catalog.searchResults(
+            path={'query': "/plone/places"},
+            portal_type=['Place', 'Link'],
+            review_state='published',
+            getId=pids,
+            sort_on='getId')
+        contents = "Pleiades Places %s" % opts.places
+        if store:
+            dump_stored(
+                site, app, store, brains, contents, out, pids, chunks=chunks)
+        else:
+            dump_places(
+                site, app, brains, contents, out, stream=opts.stream,
+                direct=opts.direct, chunks=chunks, checkpoint=checkpoint,
+                outputs=outputs)
         sys.exit(1)
 
     elif opts.places and opts.range:
 
-        g = place_graph()
         query = [s.strip() for s in opts.places.split(",")]
-        catalog = site['portal_catalog']
-        for b in catalog.searchResults(
-                path={'query': "/plone/places"},
-                portal_type=['Place', 'Link'],
-                review_state='published',
-                getId={'query': query, 'range': 'min,max'},
-                sort_on='getId'):
-            obj = b.getObject()
-            try:
-                if b.portal_type == 'Place':
-                    g += PlaceGrapher(site, app).place(obj, vocabs=False)
-                elif b.portal_type == 'Link':
-                    g += PlaceGrapher(site, app).link(obj)
-            except Exception, e:
-                log.exception("Failed to add object graph of %r to dump batch: %s", obj, e)
-            count += 1
-            if count % COMMIT_THRESHOLD == 0:
-                transaction.commit()
-        sys.stdout.write("""# Pleiades RDF Dump
-# Contents: Pleiades Places Range %s
-# Date: %s
-# License: http://creativecommons.org/licenses/by/3.0/us/
-# Credits: https://pleiades.stoa.org/credits
-# Triple count: %d
-
-""" % (opts.places, DateTime(), len(g)))
-        sys.stdout.write(g.serialize(format='turtle'))
+        brains = catalog.searchResults(
+            path={'query': "/plone/places"},
+            portal_type=['Place', 'Link'],
+            review_state='published',
+            getId={'query': query, 'range': 'min,max'},
+            sort_on='getId')
+        contents = "Pleiades Places Range %s" % opts.places
+        if store:
+            dump_stored(
+                site, app, store, brains, contents, out, query, ranged=True,
+                chunks=chunks)
+        elif opts.jobs > 1:
+            dump_sharded(
+                brains, contents, out, opts.jobs, command, option='-p')
+        else:
+            dump_places(
+                site, app, brains, contents, out, stream=opts.stream,
+                direct=opts.direct, chunks=chunks, checkpoint=checkpoint,
+                outputs=outputs)
         sys.exit(1)
 
     # Places in /errata
     elif opts.errata and not opts.range:
 
-        g = place_graph()
         pids = [s.strip() for s in opts.errata.split(",")]
-        catalog = site['portal_catalog']
-        for b in catalog.searchResults(
-                path={'query': "/plone/errata"},
-                portal_type='Place',
-                review_state='published',
-                getId=pids,
-                sort_on='getId'):
-            obj = b.getObject()
-            try:
-                g += PlaceGrapher(site, app).place(obj, vocabs=False)
-            except Exception, e:
-                log.exception("Failed to add object graph of %r to dump batch: %s", obj, e)
-        sys.stdout.write("""# Pleiades RDF Dump
-# Contents: Pleiades Errata %s
-# Date: %s
-# License: http://creativecommons.org/licenses/by/3.0/us/
-# Credits: https://pleiades.stoa.org/credits
-# Triple count: %d
-
-""" % (opts.places, DateTime(), len(g)))
-        sys.stdout.write(g.serialize(format='turtle'))
+        brains = catalog.searchResults(
+            path={'query': "/plone/errata"},
+            portal_type='Place',
+            review_state='published',
+            getId=pids,
+            sort_on='getId')
+        contents = "Pleiades Errata %s" % opts.errata
+        if store:
+            dump_stored(
+                site, app, store, brains, contents, out, pids,
+                section='errata', chunks=chunks)
+        else:
+            dump_places(
+                site, app, brains, contents, out, stream=opts.stream,
+                direct=opts.direct, chunks=chunks, checkpoint=checkpoint,
+                outputs=outputs)
         sys.exit(1)
 
     # Places in /errata
     elif opts.errata and opts.range:
 
-        g = place_graph()
         query = [s.strip() for s in opts.errata.split(",")]
-        catalog = site['portal_catalog']
-        for b in catalog.searchResults(
-                path={'query': "/plone/errata"},
-                portal_type='Place',
-                review_state='published',
-                getId={'query': query, 'range': 'min,max'},
-                sort_on='getId'):
-            obj = b.getObject()
-            try:
-                g += PlaceGrapher(site, app).place(obj, vocabs=False)
-            except Exception, e:
-                log.exception("Failed to add object graph of %r to dump batch: %s", obj, e)
-        sys.stdout.write("""# Pleiades RDF Dump
-# Contents: Pleiades Errata Range %s
-# Date: %s
-# License: http://creativecommons.org/licenses/by/3.0/us/
-# Credits: https://pleiades.stoa.org/credits
-# Triple count: %d
-
-""" % (opts.places, DateTime(), len(g)))
-        sys.stdout.write(g.serialize(format='turtle'))
+        brains = catalog.searchResults(
+            path={'query': "/plone/errata"},
+            portal_type='Place',
+            review_state='published',
+            getId={'query': query, 'range': 'min,max'},
+            sort_on='getId')
+        contents = "Pleiades Errata Range %s" % opts.errata
+        if store:
+            dump_stored(
+                site, app, store, brains, contents, out, query, ranged=True,
+                section='errata', chunks=chunks)
+        elif opts.jobs > 1:
+            dump_sharded(
+                brains, contents, out, opts.jobs, command, option='-e')
+        else:
+            dump_places(
+                site, app, brains, contents, out, stream=opts.stream,
+                direct=opts.direct, chunks=chunks, checkpoint=checkpoint,
+                outputs=outputs)
         sys.exit(1)
 
     else:
         raise ValueError("No dump options provided")
-
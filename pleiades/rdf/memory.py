@@ -0,0 +1,72 @@
+# Bounding the memory of the ZODB connection cache during bulk dumps
+
+import logging
+import resource
+
+log = logging.getLogger('pleiades.rdf')
+
+
+def rss():
+    """Get the resident set size of this process in bytes, or None where
+    /proc isn't available."""
+    try:
+        f = open('/proc/self/statm', 'rb')
+        try:
+            pages = int(f.read().split()[1])
+        finally:
+            f.close()
+    except (IOError, IndexError, ValueError):
+        return None
+    return pages * resource.getpagesize()
+
+
+def cache_size(conn):
+    """Get the number of non-ghost objects in a connection's cache."""
+    cache = getattr(conn, '_cache', None)
+    return getattr(cache, 'cache_non_ghost_count', None)
+
+
+class MemoryPolicy(object):
+    """What to do with the objects woken by a batch of places.
+
+    After every batch is committed, the connection cache is garbage
+    collected down to its target size. If minimize is true, all objects
+    in it are turned back into ghosts instead, as they are if the
+    process is using more than max_rss bytes. Cache sizes and RSS are
+    logged after every batch if report is true, and their peaks are
+    kept for a summary.
+    """
+
+    def __init__(self, minimize=False, max_rss=None, report=False):
+        self.minimize = minimize
+        self.max_rss = max_rss
+        self.report = report
+        self.batches = 0
+        self.minimized = 0
+        self.peak_objects = 0
+        self.peak_rss = 0
+
+    def collect(self, conn):
+        self.batches += 1
+        objects = cache_size(conn)
+        size = rss()
+        if self.minimize or (self.max_rss and size and size > self.max_rss):
+            conn.cacheMinimize()
+            self.minimized += 1
+        else:
+            conn.cacheGC()
+        after = cache_size(conn)
+        self.peak_objects = max(self.peak_objects, objects or 0)
+        self.peak_rss = max(self.peak_rss, size or 0)
+        if self.report:
+            log.info(
+                "Batch %d: %s objects in cache (%s after collection), "
+                "RSS %s bytes", self.batches, objects, after, size)
+
+    def stats(self):
+        return {
+            'batches': self.batches, 'minimized': self.minimized,
+            'peak_objects': self.peak_objects, 'peak_rss': self.peak_rss}
+
+
+memory_policy = MemoryPolicy()
@@ -0,0 +1,44 @@
+# Parallel dumps of places in shards of the getId space
+
+import logging
+import os
+import subprocess
+
+log = logging.getLogger('pleiades.rdf')
+
+
+def split_ids(ids, n):
+    """Split a sorted sequence of place ids into at most n contiguous,
+    inclusive (first, last) ranges of roughly equal size."""
+    ids = list(ids)
+    n = max(1, min(n, len(ids)))
+    size, extra = divmod(len(ids), n)
+    ranges = []
+    start = 0
+    for i in range(n):
+        stop = start + size + (i < extra and 1 or 0)
+        if stop > start:
+            ranges.append((ids[start], ids[stop - 1]))
+        start = stop
+    return ranges
+
+
+def run_shards(command, ranges, directory, option='-p'):
+    """Run one dump worker process per range and wait for them all.
+
+    Each worker is an independent process running the dump script with
+    its own ZODB connection. Its N-Triples output goes to a file in
+    directory. Returns the list of shard file paths, in range order.
+    """
+    procs = []
+    for i, (first, last) in enumerate(ranges):
+        path = os.path.join(directory, "shard-%03d.nt" % i)
+        args = list(command) + [
+            option, "%s,%s" % (first, last), '-r', '-s', '-o', path]
+        log.info("Starting dump shard %d: %s to %s", i, first, last)
+        procs.append((path, subprocess.Popen(args)))
+    paths = []
+    for path, proc in procs:
+        proc.wait()
+        paths.append(path)
+    return paths
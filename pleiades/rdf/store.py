@@ -0,0 +1,174 @@
+# On-disk storage of serialized place graphs and of the progress of dumps
+
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import zlib
+
+
+class PlaceStore(object):
+    """N-Triples of place graphs in a SQLite database, keyed by section
+    ('places' or 'errata') and place id.
+
+    Each graph is stored zlib compressed, with the SHA-1 of its triples,
+    the latest modification date of the place and its names and
+    locations, and a fingerprint of their source (see place_versions in
+    dump.py) for finding stale graphs. Rows are kept in key order, so
+    that dumps of whole sections or ranges of ids are read sequentially.
+
+    Changes are made in a transaction that is committed only when
+    commit() is called, so an interrupted dump leaves the store as it
+    was after the last successful one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.text_factory = str
+        if not self._exists('segments'):
+            self._create()
+
+    def _exists(self, table):
+        return self.db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND name = ?", (table,)).fetchone() is not None
+
+    def _create(self):
+        schema = (
+            "CREATE TABLE segments ("
+            "section TEXT NOT NULL, id TEXT NOT NULL, modified TEXT, "
+            "source TEXT, hash TEXT NOT NULL, triples BLOB NOT NULL, "
+            "PRIMARY KEY (section, id))")
+        try:
+            self.db.execute(schema + " WITHOUT ROWID")
+        except sqlite3.OperationalError:
+            # SQLite before 3.8.2
+            self.db.execute(schema)
+        self.db.commit()
+
+    def put(self, pid, triples, section='places', modified=None,
+            source=None):
+        """Store the triples of a place, replacing any stored before."""
+        self.db.execute(
+            "INSERT OR REPLACE INTO segments "
+            "(section, id, modified, source, hash, triples) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (section, pid, modified, source, hashlib.sha1(triples).hexdigest(),
+             buffer(zlib.compress(triples))))
+
+    def delete(self, pid, section='places'):
+        self.db.execute(
+            "DELETE FROM segments WHERE section = ? AND id = ?",
+            (section, pid))
+
+    def ids(self, section='places'):
+        return [row[0] for row in self.db.execute(
+            "SELECT id FROM segments WHERE section = ?", (section,))]
+
+    def sources(self, section='places'):
+        """Get the stored sources of the places of a section by id."""
+        return dict(self.db.execute(
+            "SELECT id, source FROM segments WHERE section = ?", (section,)))
+
+    def items(self, section='places', first=None, last=None, wanted=None):
+        """Generate (id, triples) pairs in order of place id, of all
+        places of a section or those with ids from first to last, and
+        only of those in wanted if given."""
+        query = "SELECT id, triples FROM segments WHERE section = ?"
+        args = [section]
+        if first is not None:
+            query += " AND id >= ?"
+            args.append(first)
+        if last is not None:
+            query += " AND id <= ?"
+            args.append(last)
+        for pid, triples in self.db.execute(query + " ORDER BY id", args):
+            if wanted is None or pid in wanted:
+                yield pid, zlib.decompress(str(triples))
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def replace_file(path, data):
+    """Replace the contents of a file atomically and durably. The
+    temporary file is unique, so that processes replacing the same file
+    at once don't write to it together."""
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)),
+        prefix=os.path.basename(path) + '.')
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.chmod(tmp, 0644)
+        os.rename(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
+
+
+class Checkpoint(object):
+    """Progress of an N-Triples dump to a file, saved every so many
+    places so that an interrupted dump can be resumed.
+
+    The state is the id of the last place written, the offset of the
+    end of its triples in the output, and the counts and shared triples
+    of the stream. Output is synced before the state is saved, so a
+    resumed dump truncates the file to the offset and continues with
+    the next place.
+    """
+
+    def __init__(self, path, every=500):
+        self.path = path
+        self.every = every
+        self.state = None
+        self.places = 0
+
+    def load(self):
+        """Read the saved state, or None if there is none."""
+        if os.path.exists(self.path):
+            f = open(self.path, 'rb')
+            try:
+                self.state = json.load(f)
+            finally:
+                f.close()
+            self.state['seen'] = [str(s) for s in self.state['seen']]
+        return self.state
+
+    def open(self, path):
+        """Open the output file, positioned at the saved offset if there
+        is a saved state."""
+        if self.state is None:
+            return open(path, 'wb', 1 << 20)
+        f = open(path, 'r+b', 1 << 20)
+        f.truncate(self.state['offset'])
+        f.seek(0, os.SEEK_END)
+        return f
+
+    def update(self, writer, contents, last):
+        """Count a place written and save the state every so often."""
+        self.places += 1
+        if self.places % self.every == 0:
+            self.save(writer, contents, last)
+
+    def save(self, writer, contents, last):
+        writer.out.flush()
+        os.fsync(writer.out.fileno())
+        state = writer.state()
+        state.update(contents=contents, last=last)
+        replace_file(self.path, json.dumps(state))
+        self.state = state
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
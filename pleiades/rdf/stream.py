@@ -0,0 +1,298 @@
+# Line-oriented output of RDF dumps
+
+import hashlib
+import json
+import os
+import re
+import sys
+import zlib
+import bz2
+
+from DateTime import DateTime
+from rdflib.plugins.serializers.nt import _nt_row
+
+from pleiades.rdf.store import replace_file
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+HEADER = """# Pleiades RDF Dump
+# Contents: %s
+# Date: %s
+# License: http://creativecommons.org/licenses/by/3.0/us/
+# Credits: https://pleiades.stoa.org/credits
+"""
+
+FOOTER = "# Triple count: "
+
+# Subjects of triples that belong to a single place: blank nodes and
+# the place, its names, and its locations.
+LOCAL_SUBJECT = re.compile(r'_:|<[^>]*/(places|errata)/')
+
+
+# File name extensions of the supported compression formats.
+COMPRESSIONS = {'gzip': '.gz', 'bz2': '.bz2', 'zstd': '.zst'}
+
+
+class CompressedFile(object):
+    """A writable file that compresses what is written to another."""
+
+    def __init__(self, raw, compressor):
+        self.raw = raw
+        self.compressor = compressor
+
+    def write(self, data):
+        self.raw.write(self.compressor.compress(data))
+
+    def flush(self):
+        self.raw.flush()
+
+    def close(self):
+        self.raw.write(self.compressor.flush())
+        self.raw.flush()
+        if self.raw is not sys.stdout:
+            self.raw.close()
+
+
+def open_output(path, compression=None):
+    """Open a file, or stdout if path is None, for writing with optional
+    gzip, bz2, or zstd compression. zstd requires the zstandard
+    package."""
+    if compression and compression not in COMPRESSIONS:
+        raise ValueError("Unknown compression %r" % compression)
+    if compression == 'zstd' and zstandard is None:
+        raise ValueError("zstd compression requires the zstandard package")
+    if path is None:
+        raw = sys.stdout
+    else:
+        raw = open(path, 'wb', 1 << 20)
+    if compression == 'gzip':
+        return CompressedFile(raw, zlib.compressobj(
+            9, zlib.DEFLATED, 16 + zlib.MAX_WBITS))
+    elif compression == 'bz2':
+        return CompressedFile(raw, bz2.BZ2Compressor())
+    elif compression == 'zstd':
+        return CompressedFile(raw, zstandard.ZstdCompressor().compressobj())
+    return raw
+
+
+def checksum(path):
+    """Get the SHA-256 hex digest of a file"""
+    digest = hashlib.sha256()
+    f = open(path, 'rb')
+    try:
+        for block in iter(lambda: f.read(1 << 20), ''):
+            digest.update(block)
+    finally:
+        f.close()
+    return digest.hexdigest()
+
+
+def is_complete(path):
+    """True if the N-Triples file at path was closed by a stream."""
+    f = open(path, 'rb')
+    try:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 64))
+        return FOOTER in f.read()
+    finally:
+        f.close()
+
+
+class NTriplesStream(object):
+    """Write graphs to a file as N-Triples as soon as they are made.
+
+    Only one place graph needs to be held in memory at a time. Since the
+    number of triples isn't known when the header is written, the count
+    is accumulated and written as a comment at the end of the stream.
+
+    A stream may be continued from a state() saved earlier, in which
+    case out must be positioned where the stream was when it was saved.
+    """
+
+    def __init__(self, out, contents, state=None):
+        self.out = out
+        if state is not None:
+            self.count = state['count']
+            self.bytes = state['bytes']
+            self.seen = set(state['seen'])
+            return
+        self.count = 0
+        self.bytes = 0
+        self.seen = set()
+        self.out.write(HEADER % (contents, DateTime()))
+        self.out.write("\n")
+
+    def state(self):
+        return {
+            'count': self.count, 'bytes': self.bytes,
+            'seen': sorted(self.seen), 'offset': self.out.tell()}
+
+    def write(self, g):
+        self.write_lines(g.serialize(format='nt').splitlines(True))
+
+    def write_lines(self, lines):
+        """Copy lines of N-Triples into the stream.
+
+        Triples about places and their parts are written by only one
+        place graph, but those about shared resources such as BAtlas grid
+        extents may be repeated in many and are written only once.
+        """
+        for line in lines:
+            if line.startswith('#') or not line.strip():
+                continue
+            if not LOCAL_SUBJECT.match(line):
+                if line in self.seen:
+                    continue
+                self.seen.add(line)
+            self.out.write(line)
+            self.count += 1
+            self.bytes += len(line)
+
+    def boundary(self):
+        """Mark the end of the triples of a place"""
+        pass
+
+    def merge(self, paths):
+        """Copy the triples of other N-Triples streams into this one."""
+        for path in paths:
+            f = open(path, 'rb')
+            try:
+                self.write_lines(f)
+            finally:
+                f.close()
+
+    def close(self):
+        self.out.write("\n%s%d\n" % (FOOTER, self.count))
+        self.out.flush()
+
+
+class ChunkedNTriplesStream(object):
+    """An N-Triples stream written in chunks, each a complete N-Triples
+    file of its own, that can be fetched and loaded in parallel.
+
+    A new chunk is begun at the first place boundary after the current
+    one has max_places places or max_bytes bytes of (uncompressed)
+    N-Triples. Chunks are named after path, numbered from 1, and listed
+    with their place and triple counts, sizes, and SHA-256 checksums in
+    a JSON manifest named after path.
+    """
+
+    def __init__(self, path, contents, compression=None, max_places=None,
+                 max_bytes=None):
+        root, ext = os.path.splitext(path)
+        self.template = "%s-%%03d%s%s" % (
+            root, ext, COMPRESSIONS.get(compression, ''))
+        self.manifest = root + ".manifest.json"
+        self.contents = contents
+        self.compression = compression
+        self.max_places = max_places
+        self.max_bytes = max_bytes
+        self.chunks = []
+        self.count = 0
+        self._open()
+
+    def _open(self):
+        self.path = self.template % (len(self.chunks) + 1)
+        self.file = open_output(self.path, self.compression)
+        self.stream = NTriplesStream(self.file, "%s, chunk %d" % (
+            self.contents, len(self.chunks) + 1))
+        self.places = 0
+
+    def _close(self):
+        self.stream.close()
+        self.file.close()
+        self.count += self.stream.count
+        self.chunks.append({
+            'name': os.path.basename(self.path),
+            'places': self.places,
+            'triples': self.stream.count,
+            'bytes': os.path.getsize(self.path),
+            'sha256': checksum(self.path)})
+
+    def write(self, g):
+        self.stream.write(g)
+
+    def write_lines(self, lines):
+        self.stream.write_lines(lines)
+
+    def boundary(self):
+        self.places += 1
+        if ((self.max_places and self.places >= self.max_places) or
+                (self.max_bytes and self.stream.bytes >= self.max_bytes)):
+            self._close()
+            self._open()
+
+    def close(self):
+        if self.places or not self.chunks:
+            self._close()
+        else:
+            self.file.close()
+            os.remove(self.path)
+        manifest = {
+            'contents': self.contents,
+            'date': str(DateTime()),
+            'compression': self.compression,
+            'triples': self.count,
+            'chunks': self.chunks}
+        replace_file(self.manifest, json.dumps(manifest, indent=2))
+
+
+class TurtleStream(object):
+    """Write graphs to a file as a single Turtle document as soon as they
+    are made.
+
+    Each graph is serialized on its own, and its prefix directives are
+    written only where they differ from those already in effect. Triples
+    shared by many places may be repeated.
+    """
+
+    def __init__(self, out, contents):
+        self.out = out
+        self.count = 0
+        self.prefixes = {}
+        self.out.write(HEADER % (contents, DateTime()))
+        self.out.write("\n")
+
+    def write(self, g):
+        for line in g.serialize(format='turtle').splitlines(True):
+            if line.startswith('@prefix'):
+                prefix, uri = line.split()[1:3]
+                if self.prefixes.get(prefix) == uri:
+                    continue
+                self.prefixes[prefix] = uri
+            self.out.write(line)
+        self.count += len(g)
+
+    def boundary(self):
+        pass
+
+    def close(self):
+        self.out.write("\n%s%d\n" % (FOOTER, self.count))
+        self.out.flush()
+
+
+class NTriplesSink(object):
+    """Takes triples like an rdflib Graph, but writes them to an
+    NTriplesStream as soon as they are added instead of storing and
+    indexing them.
+
+    Repeated triples about the current place are dropped using a set of
+    its lines, which reset() clears before the next place. Those about
+    shared resources are dropped by the stream.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lines = set()
+
+    def add(self, triple):
+        line = _nt_row(triple).encode('ascii', '_rdflib_nt_escape')
+        if line not in self.lines:
+            self.lines.add(line)
+            self.stream.write_lines((line,))
+
+    def reset(self):
+        self.lines.clear()
@@ -0,0 +1,232 @@
+# Run as a script, this keeps a store and an N-Triples dump of place graphs
+# up to date with the changed places queued by the site (see changes.py)
+
+import json
+import logging
+import os
+import sys
+import time
+from optparse import OptionParser
+
+from pleiades.dump import getSite, spoofRequest
+from pleiades.rdf.changes import QUEUE_ENVIRON, ChangeQueue
+from pleiades.rdf.common import connected_uids
+from pleiades.rdf.dump import place_versions, update_store, write_store
+from pleiades.rdf.memory import memory_policy
+from pleiades.rdf.store import PlaceStore, replace_file
+from pleiades.rdf.stream import COMPRESSIONS, open_output
+
+log = logging.getLogger('pleiades.rdf')
+
+
+class Worker(object):
+    """Regraphs queued places into a store, and republishes the dump of
+    the store at most every publish_every seconds.
+
+    At most batch places are taken from the queue every interval
+    seconds, which bounds the load on the database. Places are taken
+    only after settle seconds without changes. The store should first
+    be filled by an incremental dump (dump.py -i --store).
+    """
+
+    def __init__(self, site, app, queue, store, output, batch=50,
+                 interval=10.0, settle=30.0, publish_every=300.0,
+                 compression=None, metrics=None):
+        self.site = site
+        self.app = app
+        self.queue = queue
+        self.store = store
+        self.output = output
+        self.batch = batch
+        self.interval = interval
+        self.settle = settle
+        self.publish_every = publish_every
+        self.compression = compression
+        self.metrics = metrics
+        self.processed = 0
+        self.failed = 0
+        self.unpublished = 0
+        self.published = None
+        self.cycle_seconds = 0.0
+
+    def connected(self, pids):
+        """Get the ids of the places that connect with places, whatever
+        their review state, as their graphs include these places."""
+        catalog = self.site['portal_catalog']
+        uids = [b.UID for b in catalog.searchResults(
+            path={'query': "/plone/places"},
+            portal_type='Place',
+            getId=list(pids))]
+        related = set(uid for v in connected_uids(
+            self.site, uids, incoming=True).values() for uid in v)
+        if not related:
+            return set()
+        return set(b.getId for b in catalog.searchResults(
+            path={'query': "/plone/places"},
+            portal_type='Place',
+            UID=list(related)))
+
+    def update(self, pids):
+        """Regraph places, and the places that connect with them, into the
+        store with their versions, dropping those that are no longer
+        published. Returns the ids that could not be graphed."""
+        pids = set(pids) | self.connected(pids)
+        brains = self.site['portal_catalog'].searchResults(
+            path={'query': "/plone/places"},
+            portal_type=['Place', 'Link'],
+            review_state='published',
+            getId=sorted(pids),
+            sort_on='getId')
+        published = set(b.getId for b in brains)
+        for pid in pids:
+            if pid not in published:
+                self.store.delete(pid)
+        return update_store(
+            self.site, self.app, self.store, brains,
+            versions=place_versions(self.site, brains))
+
+    def publish(self):
+        """Write the stored places to the output, replacing it atomically."""
+        tmp = self.output + ".tmp"
+        out = open_output(tmp, self.compression)
+        try:
+            write_store(self.store, out, "Pleiades Places")
+        finally:
+            out.close()
+        os.rename(tmp, self.output)
+        self.published = time.time()
+        self.unpublished = 0
+
+    def cycle(self):
+        """Process one batch of queued places and publish if due."""
+        started = time.time()
+        self.app._p_jar.sync()
+        entries = self.queue.take(self.batch, self.settle)
+        if entries:
+            pids = [pid for pid, last in entries]
+            failures = set(self.update(pids))
+            done = [e for e in entries if e[0] not in failures]
+            self.queue.done(done)
+            if failures:
+                failures = sorted(failures)
+                log.warn("Failed to graph %s, requeued", ", ".join(failures))
+                self.queue.retry(failures)
+            self.processed += len(done)
+            self.failed += len(failures)
+            self.unpublished += len(done)
+        if self.unpublished and (
+                self.published is None or
+                time.time() - self.published >= self.publish_every):
+            self.publish()
+        self.cycle_seconds = time.time() - started
+        self.report()
+
+    def stats(self):
+        stats = self.queue.stats()
+        stats.update({
+            'processed': self.processed,
+            'failed': self.failed,
+            'unpublished': self.unpublished,
+            'published': self.published,
+            'cycle_seconds': self.cycle_seconds})
+        return stats
+
+    def report(self):
+        stats = self.stats()
+        log.info(
+            "%(pending)d places queued, lag %(lag).0f s, %(processed)d "
+            "processed, %(failed)d failed, %(unpublished)d unpublished",
+            stats)
+        if self.metrics:
+            replace_file(self.metrics, json.dumps(stats, indent=2))
+
+    def run(self, cycles=None):
+        """Process the queue until stopped, or for a number of cycles."""
+        while cycles is None or cycles > 0:
+            started = time.time()
+            self.cycle()
+            if cycles is not None:
+                cycles -= 1
+            time.sleep(max(0.0, self.interval - (time.time() - started)))
+
+
+if __name__ == '__main__':
+    from os import environ
+
+    parser = OptionParser()
+    parser.add_option(
+        "-q", "--queue", dest="queue",
+        default=environ.get(QUEUE_ENVIRON),
+        help="Database file of the queue of changed places (default: $%s)" % QUEUE_ENVIRON)
+    parser.add_option(
+        "--store", dest="store",
+        default=None,
+        help="Database file of place graphs, as for incremental dumps")
+    parser.add_option(
+        "-o", "--output", dest="output",
+        default=None,
+        help="N-Triples dump of the stored places, replaced when republished")
+    parser.add_option(
+        "-z", "--compress", dest="compress",
+        default=None,
+        choices=sorted(COMPRESSIONS),
+        help="Compress the dump with gzip, bz2, or zstd")
+    parser.add_option(
+        "-b", "--batch", dest="batch",
+        default=50,
+        type='int',
+        help="Most places to regraph per cycle")
+    parser.add_option(
+        "--interval", dest="interval",
+        default=10.0,
+        type='float',
+        help="Seconds between the starts of cycles")
+    parser.add_option(
+        "--settle", dest="settle",
+        default=30.0,
+        type='float',
+        help="Seconds a place must go unchanged before it is regraphed")
+    parser.add_option(
+        "--publish-every", dest="publish_every",
+        default=300.0,
+        type='float',
+        help="Least seconds between republications of the dump")
+    parser.add_option(
+        "--metrics", dest="metrics",
+        default=None,
+        help="JSON file of queue and lag metrics, replaced every cycle")
+    parser.add_option(
+        "--cycles", dest="cycles",
+        default=None,
+        type='int',
+        help="Stop after this many cycles")
+    parser.add_option(
+        "--minimize-cache", dest="minimize_cache",
+        default=False,
+        action='store_true',
+        help="Turn all objects in the ZODB cache back into ghosts after every batch of places")
+
+    opts, args = parser.parse_args(sys.argv[1:])
+
+    if not (opts.queue and opts.store and opts.output):
+        raise ValueError("A queue (-q), --store, and output (-o) are required")
+
+    app = spoofRequest(app)
+    server_name = environ.get('SERVER_NAME', 'pleiades.stoa.org').strip()
+    vh_root = environ.get('VH_ROOT', '/plone/').strip()
+    app.REQUEST.environ.update({'SERVER_PORT': '80', 'REQUEST_METHOD': 'GET',
+                                'SERVER_NAME': server_name,
+                                'VH_ROOT': vh_root})
+    app.REQUEST.setServerURL('http', server_name)
+    app.REQUEST.other['VirtualRootPhysicalPath'] = vh_root
+
+    site = getSite(app)
+
+    memory_policy.minimize = opts.minimize_cache
+
+    worker = Worker(
+        site, app, ChangeQueue(opts.queue), PlaceStore(opts.store),
+        opts.output, batch=opts.batch, interval=opts.interval,
+        settle=opts.settle, publish_every=opts.publish_every,
+        compression=opts.compress, metrics=opts.metrics)
+    worker.run(opts.cycles)